@@ -0,0 +1,204 @@
+#! /usr/bin/env python
+
+#--------------------------------------------------
+# Copyright 2008 Emma Goldberg
+#
+# This file is part of PieTree.
+#
+# PieTree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PieTree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PieTree.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------
+
+
+######################################################
+# Module:  MakeTrees.py
+######################################################
+
+'''
+Make synthetic .ttn files for benchmarking: a tree of a given shape and
+number of tips, with a random state for each tip and a random pie (state
+probabilities) for each node.
+
+The tree shapes are
+  balanced: each node splits its tips as evenly as possible
+  caterpillar: each node has one tip daughter, so the tree is as deep
+        as it can be
+  random: a pure-birth (Yule) tree, with exponential waiting times
+'''
+
+import sys
+import random
+import argparse
+
+SHAPES = ("balanced", "caterpillar", "random")
+
+
+def MakeTree(shape, ntips, rng):
+    '''
+    Return (parent, length) lists for a tree of ntips tips.  Node 0 is the
+    root, and every node comes after its parent.
+    '''
+
+    if ntips < 2:
+        raise ValueError("a tree needs at least 2 tips")
+    if shape == "balanced":
+        return _Balanced(ntips, rng)
+    elif shape == "caterpillar":
+        return _Caterpillar(ntips, rng)
+    elif shape == "random":
+        return _Yule(ntips, rng)
+    raise ValueError("unknown tree shape: " + shape)
+
+
+def _Balanced(ntips, rng):
+    parent = [-1]
+    length = [0.0]
+    todo = [(0, ntips)]         # (node, number of tips below it)
+    while todo:
+        (node, n) = todo.pop()
+        if n == 1:
+            continue
+        for k in (n // 2, n - n // 2):
+            parent.append(node)
+            length.append(rng.uniform(0.5, 1.5))
+            todo.append((len(parent) - 1, k))
+    return (parent, length)
+
+
+def _Caterpillar(ntips, rng):
+    parent = [-1]
+    length = [0.0]
+    spine = 0
+    for k in xrange(ntips - 1):
+        # a tip, and then the next node along the spine (or the last tip)
+        for j in range(2):
+            parent.append(spine)
+            length.append(rng.uniform(0.5, 1.5))
+        spine = len(parent) - 1
+    return (parent, length)
+
+
+def _Yule(ntips, rng):
+    # birth times, then lengths once every lineage is known
+    parent = [-1, 0, 0]
+    born = [0.0, 0.0, 0.0]
+    live = [1, 2]
+    now = 0.0
+    while len(live) < ntips:
+        now += rng.expovariate(len(live))
+        k = rng.randrange(len(live))
+        node = live[k]
+        born[node] = now - born[node]       # now its branch length
+        for j in range(2):
+            parent.append(node)
+            born.append(now)
+        live[k] = len(parent) - 2
+        live.append(len(parent) - 1)
+    now += rng.expovariate(len(live))
+    for node in live:
+        born[node] = now - born[node]
+    born[0] = 0.0
+    return (parent, born)
+
+
+def WriteTTN(outfile, parent, length, nstates, rng):
+    '''Write the tree and random states in .ttn format.'''
+
+    n = len(parent)
+    daughters = [[] for i in xrange(n)]
+    for i in xrange(1, n):
+        daughters[parent[i]].append(i)
+    names = [None] * n
+    ntip = nnode = 0
+    for i in xrange(n):
+        if daughters[i]:
+            nnode += 1
+            names[i] = "n%d" % nnode
+        else:
+            ntip += 1
+            names[i] = "t%d" % ntip
+
+    # the Newick string, without recursion: each node is visited once on
+    # the way down and once on the way back up
+    pieces = []
+    stack = [(0, False)]
+    while stack:
+        (i, done) = stack.pop()
+        if i == None:
+            pieces.append(",")
+            continue
+        if daughters[i] and not done:
+            pieces.append("(")
+            stack.append((i, True))
+            for (k, j) in enumerate(reversed(daughters[i])):
+                stack.append((j, False))
+                if k < len(daughters[i]) - 1:
+                    stack.append((None, False))     # a comma
+            continue
+        if daughters[i]:
+            pieces.append(")")
+        pieces.append(names[i])
+        if i > 0:
+            pieces.append(":%.6g" % length[i])
+    pieces.append(";\n")
+    outfile.write("".join(pieces))
+
+    # the states: a tip gets one state, and a node gets a probability
+    # for each state, summing to 1
+    lines = []
+    for i in xrange(n):
+        if daughters[i]:
+            p = [rng.random() for k in range(nstates)]
+            total = sum(p)
+            p = [round(x / total, 4) for x in p[:-1]]
+            p.append(max(0.0, 1 - sum(p)))
+            lines.append(names[i] + "\t" + \
+                    "\t".join(["%.4f" % x for x in p]))
+        else:
+            lines.append(names[i] + "\t%d" % rng.randrange(nstates))
+        if len(lines) >= 10000:
+            outfile.write("\n".join(lines) + "\n")
+            lines = []
+    if lines:
+        outfile.write("\n".join(lines) + "\n")
+
+
+def WriteTree(filename, shape, ntips, nstates=3, seed=1):
+    '''Make a tree and write it to filename.'''
+
+    rng = random.Random(seed)
+    (parent, length) = MakeTree(shape, ntips, rng)
+    outfile = open(filename, "w")
+    try:
+        WriteTTN(outfile, parent, length, nstates, rng)
+    finally:
+        outfile.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__, \
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("shape", choices=SHAPES)
+    parser.add_argument("ntips", type=int)
+    parser.add_argument("outfile")
+    parser.add_argument("--states", type=int, default=3, \
+            help="number of states [default 3]")
+    parser.add_argument("--seed", type=int, default=1, \
+            help="random seed [default 1]")
+    ap = parser.parse_args()
+
+    try:
+        WriteTree(ap.outfile, ap.shape, ap.ntips, ap.states, ap.seed)
+    except ValueError, error:
+        sys.exit(str(error))
@@ -0,0 +1,251 @@
+#! /usr/bin/env python
+
+#--------------------------------------------------
+# Copyright 2008 Emma Goldberg
+#
+# This file is part of PieTree.
+#
+# PieTree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PieTree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PieTree.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------
+
+
+######################################################
+# Module:  PieBench.py
+######################################################
+
+'''
+Time each stage of reading and drawing synthetic trees (see MakeTrees.py)
+of several shapes and sizes, in each tree shape and output format, and
+compare the times with a stored baseline.
+
+The stages are those of the "profile" option: parse tree (Newick.Read),
+read states, put states, tip name size, layout (CalcXY), plot (PlotTree),
+and finish (encoding the output).  The trees are generated once and kept
+in --datadir.  Each case is run --repeat times, and the quickest time for
+each stage is kept.
+
+  PieBench.py --sizes 100,10000 --save      # record a baseline
+  PieBench.py --sizes 100,10000             # compare with it
+
+Stages that take longer than the baseline by more than the tolerance are
+reported, and then the exit status is 1.  Stages shorter than --floor
+seconds are never reported, since their times are mostly noise.
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_here, os.pardir, "src"))
+
+import PieTree
+import PieLayout
+import PieReadTree
+import PieProfile
+import MakeTrees
+from PieError import PieTreeError
+
+# the stages that are read once per tree, and drawn once per picture
+READ_STAGES = ("parse tree", "read states", "put states")
+DRAW_STAGES = ("tip name size", "layout", "plot", "finish")
+
+
+def RunCase(root, nstates, shape, outformat, options):
+    '''Draw one picture, and return the seconds taken by each stage.'''
+
+    options = dict(options)
+    options.update(shape=shape, outformat=outformat)
+    for i in range(nstates):
+        options.setdefault("color%d" % i, _Gray(i, nstates))
+
+    # a fresh layout cache, so that every run lays the tree out
+    PieProfile.Start()
+    try:
+        PieTree.Render(root, options, layouts=PieLayout.LayoutCache())
+    finally:
+        profile = PieProfile.Stop()
+    return _Seconds(profile, DRAW_STAGES)
+
+
+def ReadCase(filename):
+    '''Read a tree file, and return (root, nstates, seconds per stage).'''
+
+    PieProfile.Start()
+    try:
+        (root, nstates) = PieReadTree.ReadFromFileTTN(filename)
+    finally:
+        profile = PieProfile.Stop()
+    return (root, nstates, _Seconds(profile, READ_STAGES))
+
+
+def Quickest(runs):
+    '''The smallest time for each stage, over several runs.'''
+
+    return dict([(stage, min([seconds[stage] for seconds in runs])) \
+            for stage in runs[0]])
+
+
+def _Seconds(profile, stages):
+    seconds = dict([(stage, 0.0) for stage in stages])
+    for phase in profile.phases:
+        if phase["phase"] in seconds:
+            seconds[phase["phase"]] += phase["seconds"]
+    return seconds
+
+
+def _Gray(i, nstates):
+    level = float(i) / max(nstates - 1, 1)
+    return (level, level, level)
+
+
+def Compare(results, baseline, tolerance, floor):
+    '''
+    Return a line for each stage that is slower than its baseline by more
+    than the tolerance.
+    '''
+
+    slower = []
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        (now, before) = (results[key], baseline[key])
+        if now > floor and now > before * tolerance:
+            slower.append("%-50s %9.4f s, was %9.4f s (x%.2f)" % (key, \
+                    now, before, now / max(before, 1e-9)))
+    return slower
+
+
+def RunBench(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__, \
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000,10000,100000", \
+            help="numbers of tips, separated by commas " + \
+            "[default 100,1000,10000,100000; up to 1000000 works]")
+    parser.add_argument("--trees", default=",".join(MakeTrees.SHAPES), \
+            help="tree shapes to generate [default: " + \
+            ",".join(MakeTrees.SHAPES) + "]")
+    parser.add_argument("--shapes", default="rect,radial", \
+            help="shapes to draw [default rect,radial]")
+    parser.add_argument("--formats", default="pdf,eps,svg,png", \
+            help="output formats [default pdf,eps,svg,png]")
+    parser.add_argument("--states", type=int, default=3, \
+            help="number of states [default 3]")
+    parser.add_argument("--repeat", type=int, default=3, \
+            help="times to run each case, keeping the quickest [default 3]")
+    parser.add_argument("--batch", choices=("yes", "no"), default="no", \
+            help="draw with the batch option [default no]")
+    parser.add_argument("--datadir", \
+            default=os.path.join(tempfile.gettempdir(), "pietree-bench"), \
+            help="where the generated trees are kept")
+    parser.add_argument("--baseline", \
+            default=os.path.join(_here, "baseline.json"), \
+            help="file of stored times [default bench/baseline.json]")
+    parser.add_argument("--save", action="store_true", \
+            help="store these times as the baseline")
+    parser.add_argument("--tolerance", type=float, default=1.25, \
+            help="report stages slower than baseline times this " + \
+            "[default 1.25]")
+    parser.add_argument("--floor", type=float, default=0.01, \
+            help="ignore stages quicker than this many seconds " + \
+            "[default 0.01]")
+    ap = parser.parse_args(argv)
+    if ap.repeat < 1:
+        parser.error("--repeat should be at least 1")
+
+    sizes = [int(size) for size in ap.sizes.split(",")]
+    trees = ap.trees.split(",")
+    shapes = ap.shapes.split(",")
+    formats = ap.formats.split(",")
+    options = {"batch": ap.batch, "cache": "no"}
+
+    if not os.path.isdir(ap.datadir):
+        os.makedirs(ap.datadir)
+
+    results = {}
+    print "%-40s %s" % ("case", "  ".join(["%13s" % stage for stage in \
+            READ_STAGES + DRAW_STAGES]))
+    for tree in trees:
+        for size in sizes:
+            filename = os.path.join(ap.datadir, "%s-%d-%d.ttn" % (tree, \
+                    size, ap.states))
+            if not os.path.exists(filename):
+                MakeTrees.WriteTree(filename, tree, size, ap.states)
+
+            runs = []
+            for k in range(ap.repeat):
+                root = None         # let the last one go first
+                (root, nstates, seconds) = ReadCase(filename)
+                runs.append(seconds)
+            name = "%s/%d" % (tree, size)
+            _Report(results, name, READ_STAGES, Quickest(runs))
+
+            for shape in shapes:
+                for outformat in formats:
+                    runs = [RunCase(root, nstates, shape, outformat, \
+                            options) for k in range(ap.repeat)]
+                    _Report(results, "%s/%s/%s" % (name, shape, \
+                            outformat), DRAW_STAGES, Quickest(runs))
+
+    if ap.save:
+        outfile = open(ap.baseline, "w")
+        try:
+            json.dump({"date": time.strftime("%Y-%m-%d %H:%M"), \
+                    "python": sys.version.split()[0], "seconds": results}, \
+                    outfile, indent=1, sort_keys=True)
+            outfile.write("\n")
+        finally:
+            outfile.close()
+        print "\nsaved baseline in %s" % ap.baseline
+        return 0
+
+    if not os.path.exists(ap.baseline):
+        print "\nno baseline to compare with; make one with --save"
+        return 0
+    baseline = json.load(open(ap.baseline))
+    slower = Compare(results, baseline["seconds"], ap.tolerance, ap.floor)
+    print "\ncompared with the baseline of %s:" % baseline["date"]
+    if not slower:
+        print "nothing slower"
+        return 0
+    print "\n".join(slower)
+    return 1
+
+
+def _Report(results, name, stages, seconds):
+    '''Print a line of times, and keep them as "case/stage".'''
+
+    cells = []
+    for stage in READ_STAGES + DRAW_STAGES:
+        if stage in stages:
+            results[name + "/" + stage] = seconds[stage]
+            cells.append("%13.4f" % seconds[stage])
+        else:
+            cells.append("%13s" % "")
+    print "%-40s %s" % (name, "  ".join(cells))
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+
+    try:
+        sys.exit(RunBench())
+    except PieTreeError, error:
+        if error.value != None:
+            sys.stderr.write("\n" + error.value + "\n\n")
+        sys.exit(1)
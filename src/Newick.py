@@ -30,130 +30,397 @@
 
 
 from TreeStruct import TreeNode
-import sys
+from TreeArray import TreeArray, TreeNodeView
 import re
+import gc
 
 
 class NewickError(Exception):
     def __init__(self, value):
+        self.reason = value
         self.value = "ERROR: " + value
     def __str__(self):
         return repr(self.value)
 
 
-def Read(tree_string):
+# A token is a quoted label, a single Newick symbol, or a run of anything else
+# (an unquoted label or a branch length, possibly padded with whitespace).
+# Whitespace before a token is skipped, so that it can't run on into a quote.
+_newick_token = re.compile(r"\s*('(?:[^']|'')*'|[(),;:]|[^(),;:]+)")
+_LABEL = 'label'
+_LENGTH = 'length'
+_NAN = float('nan')
+
+# labels with any of these are written in quotes
+_needs_quotes = re.compile(r"[\s(),;:\[\]']")
+
+# how many pieces of text Write() gathers before writing them out
+_WRITE_PIECES = 8192
+
+
+def Read(tree_string, translate=None):
     '''
     Take a Newick string and return the root of the tree built from it.
     (note on tip/node labels: they are honored, and even spaces are okay)
+    If a translate dictionary is given, tip labels found in it are replaced.
+
+    The string is scanned once, token by token, and the tree is built with an
+    explicit stack of unclosed nodes, so the nesting depth is not limited.
+    Raise a NewickError if the string is malformed.
     '''
 
-    ### check if the Newick string seems well-formed
+    # The garbage collector would otherwise rescan the growing tree (which is
+    # full of parent <-> daughter cycles) over and over while it is built.
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
     try:
-        Check(tree_string)
-    except NewickError, error:
-        print error.value
-        print "Bad Newick string.  Aborting in Newick.Read()..."
-        sys.exit(1)
-
-    # the first live char must be a (, so skip to there
-    index = tree_string.find('(')
-    root = TreeNode(parent=None)
-    current_node = root
-
-    ### now start building the tree
-
-    index += 1
-    next_char = tree_string[index]
-    while next_char != ';':
-
-        if next_char == ' ':
-            pass
-
-        # add an internal node, or a tip and its label
-        elif next_char == '(':
-            new_node = TreeNode(parent=current_node)
-            if current_node.daughters == None:
-                current_node.daughters = [new_node]
+        return _MakeNodes(*_Build(tree_string, translate))
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def ReadCompact(tree_string, translate=None):
+    '''
+    Like Read(), but return the tree as a TreeArray rather than as linked
+    TreeNodes.
+    '''
+
+    return TreeArray.FromLists(*_Build(tree_string, translate))
+
+
+def _Build(tree_string, translate):
+    '''
+    Parse the Newick string into three lists, with one entry per node in
+    preorder: the parent index (-1 for the root), the label, and the branch
+    length (nan if there is none).
+    '''
+
+    parents = []
+    labels = []
+    lengths = []
+
+    tokens = iter(_newick_token.findall(tree_string))
+    stack = []      # internal nodes whose ( has not been closed yet
+    node = -1       # the node that a following label or length belongs to
+    prev = None     # what the previous token was: a symbol, _LABEL or _LENGTH
+
+    for token in tokens:
+
+        if token == '(':
+            if prev not in (None, '(', ','):
+                raise NewickError("misplaced ( in Newick string")
+            if prev != None and not stack:
+                raise NewickError("text after the closing ) in Newick string")
+            node = len(parents)
+            parents.append(stack[-1] if stack else -1)
+            labels.append(None)
+            lengths.append(_NAN)
+            stack.append(node)
+
+        # a , or ) right after ( or , means an unlabeled tip
+        elif token == ',':
+            if not stack or prev == ':':
+                raise NewickError("misplaced , in Newick string")
+            if prev == '(' or prev == ',':
+                parents.append(stack[-1])
+                labels.append(None)
+                lengths.append(_NAN)
+            node = -1
+
+        elif token == ')':
+            if not stack:
+                raise NewickError("mismatched ( ) in Newick string")
+            if prev == '(':
+                raise NewickError("shouldn't have () in Newick string")
+            if prev == ':':
+                raise NewickError("misplaced ) in Newick string")
+            if prev == ',':
+                parents.append(stack[-1])
+                labels.append(None)
+                lengths.append(_NAN)
+            node = stack.pop()
+
+        elif token == ':':
+            if prev == '(' or prev == ',':
+                node = len(parents)
+                parents.append(stack[-1])
+                labels.append(None)
+                lengths.append(_NAN)
+            elif prev != _LABEL and prev != ')':
+                raise NewickError("misplaced : in Newick string")
+
+        elif token == ';':
+            if not parents:
+                raise NewickError("Newick strings must start with a (")
+            if stack:
+                raise NewickError("mismatched ( ) in Newick string")
+            if prev == ':':
+                raise NewickError("missing branch length before ;")
+            for token in tokens:
+                if token.strip():
+                    raise NewickError("too many ; in Newick string")
+            break
+
+        else:
+            token = token.strip()
+            if not token:
+                continue
+
+            if prev == ':':
+                try:
+                    lengths[node] = float(token)
+                except ValueError:
+                    raise NewickError('bad branch length "' + token + \
+                            '" in Newick string')
+                token = _LENGTH
+
+            # the label of a new tip
+            elif prev == '(' or prev == ',':
+                if token[0] == "'":
+                    token = _Unquote(token)
+                if translate:
+                    token = translate.get(token, token)
+                node = len(parents)
+                parents.append(stack[-1])
+                labels.append(token)
+                lengths.append(_NAN)
+                token = _LABEL
+
+            # the label of the node that was just closed
+            elif prev == ')':
+                if token[0] == "'":
+                    token = _Unquote(token)
+                labels[node] = token
+                token = _LABEL
+
+            elif prev == None:
+                raise NewickError("Newick strings must start with a (")
             else:
-                current_node.daughters.append(new_node)
-            current_node = new_node
-
-        # back up to parent so a new sister can be added
-        elif next_char == ',':
-            current_node = current_node.parent
-
-        # back up to parent, and possibly get its label
-        elif next_char == ')':
-            current_node = current_node.parent
-            if tree_string[index+1] not in [',',')','(',';',':']:
-                gotcha = _ToNextSymbol(tree_string, index+1)
-                index = gotcha[1]
-                current_node.label = gotcha[0]
-
-        # get branch length
-        elif next_char == ':':
-            gotcha = _ToNextSymbol(tree_string, index+1)
-            index = gotcha[1]
-            current_node.length = float(gotcha[0])
-
-        # at the start of a label, so add that node
+                raise NewickError('unexpected "' + token + \
+                        '" in Newick string')
+
+        prev = token
+
+    else:
+        raise NewickError("Newick strings must end with a ;")
+
+    # when the tree_string has surrounding (...), the current root has the 
+    #   real root as its only daughter
+    if parents.count(0) == 1:
+        parents = [p - 1 for p in parents[1:]]
+        parents[0] = -1
+        labels = labels[1:]
+        lengths = lengths[1:]
+    if lengths[0] != lengths[0]:
+        lengths[0] = 0.0
+
+    return (parents, labels, lengths)
+
+
+def _MakeNodes(parents, labels, lengths):
+    '''Link up TreeNodes from the lists made by _Build, and return the root.'''
+
+    nodes = []
+    for i in xrange(len(parents)):
+        length = lengths[i]
+        if length != length:
+            length = None
+        p = parents[i]
+        if p < 0:
+            node = TreeNode(labels[i], None, length, None, None)
         else:
-            gotcha = _ToNextSymbol(tree_string, index)
-            index = gotcha[1]
-            new_node = TreeNode(parent=current_node, label=gotcha[0])
-            if current_node.daughters == None:
-                current_node.daughters = [new_node]
+            parent = nodes[p]
+            node = TreeNode(labels[i], None, length, None, parent)
+            if parent.daughters == None:
+                parent.daughters = [node]
             else:
-                current_node.daughters.append(new_node)
-            current_node = new_node
+                parent.daughters.append(node)
+        nodes.append(node)
+
+    return nodes[0]
+
 
-        index += 1
-        next_char = tree_string[index]
+def _Unquote(label):
+    '''Strip the quotes from a 'quoted label', where '' stands for '.'''
 
-     # when the tree_string has surrounding (...), the current root has the 
-     #   real root as its only daughter
-    if len(root.daughters) == 1:
-         root = root.daughters[0]
-         root.parent = None
-    if root.length == None:
-        root.length = 0.0
-    return root
+    if len(label) > 1 and label[0] == "'" and label[-1] == "'":
+        return label[1:-1].replace("''", "'")
+    return label
 
 
-def _ToNextSymbol(tree_string, start_index):
+def Write(root, outfile, precision=None, nodelabels=True, states=False):
+    '''
+    Write the tree below root to an open file, as a Newick string on one
+    line.  Branch lengths are written exactly, or rounded to precision
+    significant digits.  Internal node labels are left out unless
+    nodelabels.  With states, the states of the labeled tips and nodes
+    follow the tree, one line each, as in a .ttn file.
+
+    The tree is walked with an explicit stack and written out a piece at a
+    time, so the nesting depth is not limited and the whole string is
+    never held in memory.
+    '''
+
+    if isinstance(root, TreeNodeView):
+        _WriteArray(root.tree, root.index, outfile, precision, nodelabels, \
+                states)
+        return
+
+    pieces = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+
+        # the , between two sisters
+        if isinstance(node, str):
+            pieces.append(node)
+            continue
+
+        # an internal node, closed after its daughters are written
+        if isinstance(node, tuple):
+            node = node[0]
+            pieces.append(")")
+            if nodelabels and node.label != None:
+                pieces.append(_Quote(node.label))
+        else:
+            daughters = node.daughters
+            if daughters:
+                pieces.append("(")
+                stack.append((node,))
+                for k in xrange(len(daughters) - 1, 0, -1):
+                    stack.append(daughters[k])
+                    stack.append(",")
+                stack.append(daughters[0])
+                continue
+            if node.label != None:
+                pieces.append(_Quote(node.label))
+
+        if node.length != None:
+            pieces.append(":" + _Number(node.length, precision))
+        if len(pieces) >= _WRITE_PIECES:
+            outfile.write("".join(pieces))
+            pieces = []
+
+    pieces.append(";\n")
+    outfile.write("".join(pieces))
+
+    if states:
+        _WriteStates(root, outfile, precision, nodelabels)
+
+
+def _WriteStates(root, outfile, precision, nodelabels):
+    '''Write a line for each labeled tip or node that has a state.'''
+
+    lines = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        daughters = node.daughters
+        if daughters:
+            stack.extend(reversed(daughters))
+            if not nodelabels:
+                continue
+        if node.label == None or node.state == None:
+            continue
+
+        if isinstance(node.state, list):
+            values = [_Number(value, precision) for value in node.state]
+        else:
+            values = [str(node.state)]
+        lines.append(node.label + " " + " ".join(values) + "\n")
+        if len(lines) >= _WRITE_PIECES:
+            outfile.write("".join(lines))
+            lines = []
 
-    stop_index = start_index+1
-    next_char = tree_string[stop_index]
-    while next_char not in [',',')','(',';',':']:
-        stop_index += 1
-        next_char = tree_string[stop_index]
-    str = tree_string[start_index:stop_index]
-    return [str, stop_index-1]
+    outfile.write("".join(lines))
 
 
-def Check(nstr):
+def _WriteArray(tree, top, outfile, precision, nodelabels, states):
     '''
-    Check for various malformations of a Newick string.
-    Raise a NewickError if there is a problem.
+    As for Write, for node top of a TreeArray, straight from its arrays.
+    On the stack, ~k (which is negative) closes internal node k.
     '''
-    nstr = nstr.strip()
-    if nstr[-1] != ";":
-        raise NewickError, "Newick strings must end with a ;"
-    if nstr.count(";") != 1:
-        raise NewickError, "too many ; in Newick string"
-    if nstr.count("(") != nstr.count(")"):
-        raise NewickError, "mismatched ( ) in Newick string"
-    if nstr.find(")(") != -1:
-        raise NewickError, "shouldn't have )( in Newick string"
-    if nstr.find("()") != -1:
-        raise NewickError, "shouldn't have () in Newick string"
 
+    (parent, first, sister) = (tree.parent, tree.first_daughter, \
+            tree.next_sister)
+    (label, length) = (tree.label, tree.length)
 
-def ReadFromFile(filename):
+    pieces = []
+    stack = [top]
+    while stack:
+        k = stack.pop()
+        if k < 0:
+            k = ~k
+            pieces.append(")")
+            if nodelabels and label[k] != None:
+                pieces.append(_Quote(label[k]))
+        else:
+            if k != top and first[parent[k]] != k:
+                pieces.append(",")
+            d = first[k]
+            if d >= 0:
+                pieces.append("(")
+                stack.append(~k)
+                daughters = []
+                while d >= 0:
+                    daughters.append(d)
+                    d = sister[d]
+                daughters.reverse()
+                stack.extend(daughters)
+                continue
+            if label[k] != None:
+                pieces.append(_Quote(label[k]))
+
+        if length[k] == length[k]:
+            pieces.append(":" + _Number(length[k], precision))
+        if len(pieces) >= _WRITE_PIECES:
+            outfile.write("".join(pieces))
+            pieces = []
+
+    pieces.append(";\n")
+    outfile.write("".join(pieces))
+
+    if not states:
+        return
+    lines = []
+    state = tree.state
+    for k in tree.Preorder(top):
+        if label[k] == None or state[k] == None or \
+                (not nodelabels and first[k] >= 0):
+            continue
+        if isinstance(state[k], list):
+            values = [_Number(value, precision) for value in state[k]]
+        else:
+            values = [str(state[k])]
+        lines.append(label[k] + " " + " ".join(values) + "\n")
+        if len(lines) >= _WRITE_PIECES:
+            outfile.write("".join(lines))
+            lines = []
+    outfile.write("".join(lines))
+
+
+def _Number(value, precision):
+    if precision == None:
+        return repr(value)
+    return "%.*g" % (precision, value)
+
+
+def _Quote(label):
+    '''Put a label in quotes if it needs them, with ' written as ''.'''
+
+    if _needs_quotes.search(label):
+        return "'" + label.replace("'", "''") + "'"
+    return label
+
+
+def ReadFromFile(filename, compact=False):
     '''
     From the specified file, try to read in the first line as a Newick string.
     Blank lines and ones beginning with # or [ are skipped.
     Returns the root of the tree, or None if no tree was formed.
+    (If compact, returns a TreeArray rather than the root.)
+    Raises a NewickError if that line is not a good Newick string.
     '''
 
     try:
@@ -162,26 +429,155 @@ def ReadFromFile(filename):
         return None
         # raise NewickError("can't open the file " + filename)
 
-    # get the first non-blank, non-comment line in the file
-    while 1:
-        try:
-            line = infile.next().strip()
-            if line and line[0]!= "#" and line[0]!="[":
-                break
-                # found a useful line, so stop looking
-        except StopIteration:
-            print "ERROR: end of file reached before finding a possible tree description."
-            line = None
-            break
-
+    line = FindTreeLine(infile)
     infile.close()
 
     # if a good line was found, try to read it in as a tree, and return the root
     if line != None:
-        try:
-            root = Read(line)
-            return root
-        except NewickError:
-            pass
+        if compact:
+            return ReadCompact(line)
+        return Read(line)
     else:
-        return None 
+        return None
+
+
+def FindTreeLine(infile):
+    '''
+    Return the first non-blank line of the open file that doesn't begin with
+    # or [, leaving the file positioned just after it (so that tell() is
+    right).  Returns None if the end of the file is reached first.
+    '''
+
+    for line in iter(infile.readline, ""):
+        line = line.strip()
+        if line and line[0]!= "#" and line[0]!="[":
+            return line
+
+    return None
+
+
+# Splits NEXUS/Newick text into quoted labels, [ ], ;, and everything else.
+_statement_piece = re.compile(r"('(?:[^']|'')*'|\[|\]|;)")
+
+
+def ReadTrees(filename, burnin=0, thin=1, compact=False):
+    '''
+    Generate the roots of all the trees in the specified file, one at a time,
+    so that only one tree (and one tree string) is in memory at once.
+
+    The file may be a NEXUS file (first line #NEXUS), in which case the tree
+    commands in its TREES blocks are read, and TRANSLATE tables are applied
+    to the tip labels.  Otherwise it should be a series of Newick strings,
+    each ending with a ; and possibly spread over several lines; lines
+    beginning with # are skipped.  Comments in [ ] are ignored.
+
+    The first burnin trees are skipped without being parsed, and after that
+    only every thin-th tree is returned.  If compact, TreeArrays are
+    generated instead of roots.
+    '''
+
+    if burnin < 0 or thin < 1:
+        raise ValueError("need burnin >= 0 and thin >= 1")
+
+    infile = open(filename, "r", 1 << 16)
+    try:
+        line = ""
+        for line in infile:
+            if line.strip():
+                break
+        nexus = line.strip().upper() == "#NEXUS"
+        if nexus:
+            lines = infile
+        else:
+            lines = _SkipCommentLines(line, infile)
+
+        count = 0
+        for (tree_string, translate) in _TreeStrings(_Statements(lines), \
+                nexus):
+            count += 1
+            if count > burnin and (count - burnin - 1) % thin == 0:
+                if compact:
+                    yield ReadCompact(tree_string, translate)
+                else:
+                    yield Read(tree_string, translate)
+    finally:
+        infile.close()
+
+
+def _SkipCommentLines(first_line, infile):
+    '''Pass along lines that don't begin with #, starting with first_line.'''
+
+    if not first_line.lstrip().startswith("#"):
+        yield first_line
+    for line in infile:
+        if not line.lstrip().startswith("#"):
+            yield line
+
+
+def _Statements(lines):
+    '''
+    Generate the ;-terminated statements found in some lines of text, with
+    comments in [ ] removed.  The ; itself is not included.
+    '''
+
+    pieces = []
+    depth = 0       # how many [ ] comments we're inside
+    for line in lines:
+        for piece in _statement_piece.split(line):
+            if piece == "[":
+                depth += 1
+            elif piece == "]":
+                if depth > 0:
+                    depth -= 1
+            elif depth > 0 or not piece:
+                continue
+            elif piece == ";":
+                statement = "".join(pieces).strip()
+                pieces = []
+                if statement:
+                    yield statement
+            else:
+                pieces.append(piece)
+
+    if "".join(pieces).strip():
+        raise NewickError("file ends without a ; after the last statement")
+
+
+def _TreeStrings(statements, nexus):
+    '''
+    Generate a (Newick string, translate table) pair for each tree among the
+    statements.  The table is None if there is no translation to be done.
+    '''
+
+    if not nexus:
+        for statement in statements:
+            yield (statement + ";", None)
+        return
+
+    in_trees = False
+    translate = None
+    for statement in statements:
+        words = statement.split(None, 1)
+        command = words[0].lower()
+
+        if command == "begin":
+            in_trees = len(words) > 1 and words[1].strip().lower() == "trees"
+            translate = None
+        elif command in ("end", "endblock"):
+            in_trees = False
+        elif not in_trees:
+            continue
+
+        elif command == "translate":
+            translate = {}
+            if len(words) > 1:
+                for pair in words[1].split(","):
+                    pair = pair.split(None, 1)
+                    if len(pair) != 2:
+                        raise NewickError("bad TRANSLATE table in NEXUS file")
+                    translate[pair[0]] = _Unquote(pair[1].strip())
+
+        elif command in ("tree", "utree"):
+            if len(words) < 2 or "=" not in words[1]:
+                raise NewickError("bad TREE command in NEXUS file")
+            yield (words[1].split("=", 1)[1].strip() + ";", translate)
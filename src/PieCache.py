@@ -0,0 +1,279 @@
+#! /usr/bin/env python
+
+#--------------------------------------------------
+# Copyright 2008 Emma Goldberg
+# 
+# This file is part of PieTree.
+# 
+# PieTree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# PieTree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with PieTree.  If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------- 
+
+######################################################
+# Module:  PieCache.py
+######################################################
+
+'''
+Keep a binary snapshot of each tree file that has been read, so that
+drawing the same tree again doesn't require parsing its text again.
+
+A snapshot holds the tree topology, branch lengths, labels, and states, as
+raw arrays that are read back through a memory map, and the notes and
+warnings given while the file was read, which are given again each time
+the snapshot is used.  It records the size,
+modification time, and SHA-1 digest of the file it came from.  It is used
+only if the file still has the same size and either the same modification
+time or the same contents.
+
+Snapshots go in $PIETREE_CACHE, or else $XDG_CACHE_HOME/pietree, or else
+~/.cache/pietree.  Only the KEEP_SNAPSHOTS used most recently are kept.
+'''
+
+import os
+import sys
+import mmap
+import glob
+import struct
+import hashlib
+import tempfile
+from array import array
+
+from TreeArray import TreeArray
+
+_MAGIC = "PIETREE\x02"
+
+# magic, byte order, source size, mtime, sha1, nodes, states, label bytes,
+# message bytes
+_HEADER = struct.Struct("<8s c q d 20s i i q q")
+
+# how many snapshots are kept
+KEEP_SNAPSHOTS = 32
+
+_NAN = float('nan')
+
+
+def CacheDir():
+    '''Return the directory where snapshots are kept.'''
+
+    if os.environ.get("PIETREE_CACHE"):
+        return os.environ["PIETREE_CACHE"]
+    base = os.environ.get("XDG_CACHE_HOME") or \
+            os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "pietree")
+
+
+def SnapshotPath(filename):
+    '''Return the name of the snapshot file for the given tree file.'''
+
+    key = hashlib.sha1(os.path.abspath(filename)).hexdigest()
+    return os.path.join(CacheDir(), key + ".snap")
+
+
+def FileDigest(filename):
+    '''Return the SHA-1 digest of the file's contents.'''
+
+    digest = hashlib.sha1()
+    infile = open(filename, "rb")
+    try:
+        block = infile.read(1 << 20)
+        while block:
+            digest.update(block)
+            block = infile.read(1 << 20)
+    finally:
+        infile.close()
+    return digest.digest()
+
+
+def Load(filename):
+    '''
+    Return (tree, nstates, messages) from the snapshot of this file, with
+    the tree as a TreeArray and the messages given when the file was read,
+    or None if there is no snapshot that is still good.
+    '''
+
+    snapname = SnapshotPath(filename)
+    try:
+        info = os.stat(filename)
+        snapfile = open(snapname, "rb")
+    except (IOError, OSError):
+        return None
+
+    try:
+        mapped = mmap.mmap(snapfile.fileno(), 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):
+        snapfile.close()
+        return None
+
+    try:
+        if len(mapped) < _HEADER.size:
+            return None
+        header = _HEADER.unpack_from(mapped, 0)
+        (magic, order, size, mtime, digest, n, nstates, nlabel, nmessage) = \
+                header
+        if magic != _MAGIC or order != sys.byteorder[0] or \
+                size != info.st_size:
+            return None
+
+        # same size but touched: trust it only if the contents are the same
+        if mtime != info.st_mtime:
+            if digest != FileDigest(filename):
+                return None
+        else:
+            header = None
+
+        (tree, messages) = _Unpack(mapped, n, nstates, nlabel, nmessage)
+
+    finally:
+        mapped.close()
+        snapfile.close()
+
+    _Touch(snapname, header, info.st_mtime)
+    return (tree, nstates, messages)
+
+
+def _Touch(snapname, header, mtime):
+    '''
+    Mark the snapshot as just used and, if header is given, record the new
+    modification time of its file there, so the check is cheap next time.
+    The cache may be read-only, so failure is not an error.
+    '''
+
+    try:
+        if header != None:
+            snapfile = open(snapname, "r+b")
+            try:
+                snapfile.write(_HEADER.pack(*(header[:3] + (mtime,) + \
+                        header[4:])))
+            finally:
+                snapfile.close()
+        else:
+            os.utime(snapname, None)
+    except (IOError, OSError):
+        pass
+
+
+def Save(filename, tree, nstates, messages=()):
+    '''
+    Write a snapshot of the tree (a TreeArray) and its nstates states, as
+    read from this file, with the messages given while reading it.  The
+    least recently used snapshots beyond KEEP_SNAPSHOTS are removed.
+    Failure to write it is not an error.
+    '''
+
+    snapname = SnapshotPath(filename)
+    try:
+        info = os.stat(filename)
+        digest = FileDigest(filename)
+        if not os.path.isdir(CacheDir()):
+            os.makedirs(CacheDir())
+        (fd, tempname) = tempfile.mkstemp(dir=CacheDir())
+    except (IOError, OSError):
+        return
+
+    try:
+        snapfile = os.fdopen(fd, "wb")
+        try:
+            _Pack(snapfile, tree, nstates, info, digest, messages)
+        finally:
+            snapfile.close()
+        os.rename(tempname, snapname)
+    except (IOError, OSError):
+        try:
+            os.remove(tempname)
+        except OSError:
+            pass
+        return
+
+    _Prune()
+
+
+def _Prune():
+    '''Remove all but the KEEP_SNAPSHOTS snapshots used most recently.'''
+
+    ages = []
+    for snapname in glob.glob(os.path.join(CacheDir(), "*.snap")):
+        try:
+            ages.append((os.stat(snapname).st_mtime, snapname))
+        except OSError:
+            pass
+    ages.sort()
+    for (mtime, snapname) in ages[:-KEEP_SNAPSHOTS]:
+        try:
+            os.remove(snapname)
+        except OSError:
+            pass
+
+
+def _Pack(snapfile, tree, nstates, info, digest, messages):
+
+    n = len(tree)
+    has_label = array('b', [label != None for label in tree.label])
+    labels = "\0".join([label or "" for label in tree.label])
+
+    tip_state = array('i', [-1]) * n
+    node_state = array('d', [_NAN]) * (n * nstates)
+    for i in xrange(n):
+        state = tree.state[i]
+        if state == None:
+            continue
+        if tree.first_daughter[i] < 0:
+            tip_state[i] = state
+        else:
+            node_state[i*nstates:(i+1)*nstates] = array('d', state)
+
+    text = "\0".join(messages)
+    snapfile.write(_HEADER.pack(_MAGIC, sys.byteorder[0], info.st_size, \
+            info.st_mtime, digest, n, nstates, len(labels), len(text)))
+    for part in (tree.parent, tree.first_daughter, tree.last_daughter, \
+            tree.next_sister, tree.length, tip_state, node_state, has_label):
+        snapfile.write(part.tostring())
+    snapfile.write(labels)
+    snapfile.write(text)
+
+
+def _Unpack(mapped, n, nstates, nlabel, nmessage):
+
+    pos = [_HEADER.size]
+    def Take(typecode, count):
+        part = array(typecode)
+        start = pos[0]
+        pos[0] += count * part.itemsize
+        part.fromstring(mapped[start:pos[0]])
+        return part
+
+    tree = TreeArray()
+    tree.parent = Take('i', n)
+    tree.first_daughter = Take('i', n)
+    tree.last_daughter = Take('i', n)
+    tree.next_sister = Take('i', n)
+    tree.length = Take('d', n)
+    tree.time = array('d', [_NAN]) * n
+    tip_state = Take('i', n)
+    node_state = Take('d', n * nstates)
+    has_label = Take('b', n)
+    labels = mapped[pos[0]:pos[0] + nlabel].split("\0")
+    text = mapped[pos[0] + nlabel:pos[0] + nlabel + nmessage]
+
+    tree.label = [labels[i] if has_label[i] else None for i in xrange(n)]
+    state = tree.state = [None] * n
+    for i in xrange(n):
+        if tip_state[i] >= 0:
+            state[i] = tip_state[i]
+        elif tree.first_daughter[i] >= 0:
+            row = node_state[i*nstates:(i+1)*nstates]
+            if row and row[0] == row[0]:
+                state[i] = row.tolist()
+
+    if text:
+        return (tree, text.split("\0"))
+    return (tree, [])
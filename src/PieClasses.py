@@ -25,9 +25,13 @@
 # Date:     Nov, 2011 (orig Apr 2008)
 ######################################################
 
-from math import cos, sin, pi
+from math import pi
 import cairo
 import TreeStruct
+import PieLayout
+import PieText
+import PieDetail
+from PieError import PieTreeError
 
 #--------------------------------------------------
 # For drawing a tree of any shape
@@ -40,96 +44,169 @@ class PieTree():
        * tree attributes: ntips, nstates
        * node/tip drawing functions
           further fleshed out in the rectangular and radial subclasses
-       * cairo surface to be drawn to
+       * cairo surface to be drawn to, and a PieText.Text for the labels
        * plotting variables
+       * the layout, with the positions of all the nodes
+       * the level of detail, if some things are too small to draw
     '''
 
-    def __init__(self, root, ntips, nstates, surface, plot_values):
+    def __init__(self, root, ntips, nstates, surface, plot_values, \
+            text=None):
         self.root = root
         self.ntips = ntips
         self.nstates = nstates
         self.surface = surface
+        if text == None:
+            text = PieText.Text(surface)
+        self.text = text
         self.plot_vars = plot_values
+        self.layout = None
+        self.detail = None
 
     def MaxTipNameSize(self):
         '''Find the longest (widest) tip name in this tree.'''
 
-        # todo: extract answer by using return rather than list
-        def MTNS(node, cr, tipsize):
+        text = self.text
+        tipsize = -1
+        for node in self.root.Preorder():
             if node.daughters == None:
-                thistipsize = cr.text_extents(node.label)[2]
-                if thistipsize > tipsize[0]:
-                    tipsize[0] = thistipsize
-            else:
-                for d in node.daughters:
-                    MTNS(d, cr, tipsize)
+                thistipsize = text.Extents(node.label)[2]
+                if thistipsize > tipsize:
+                    tipsize = thistipsize
+
+        return tipsize
+
+    def CalcXY(self, tipsize, layouts=None):
+        '''Lay out the tree, leaving tipsize for the tip names (see
+           Place).  A layout of the same tree with the same LayoutKey is
+           reused from layouts (a PieLayout.LayoutCache, by default the
+           one shared by the whole process).'''
 
-        tipsize = [-1]
-        MTNS(self.root, self.surface, tipsize)
+        self.layout = PieLayout.Find(self.root, self.LayoutKey(tipsize), \
+                lambda layout: self.Place(layout, tipsize), layouts)
 
-        return tipsize[0]
+    def TipSize(self):
+        '''The room needed for tip names (almost none if they're not
+           shown).'''
+
+        if self.plot_vars.tipnamesize == 0:
+            return 1e-10
+        return self.MaxTipNameSize()
 
     def PlotTree(self):
         '''Calls the drawing functions for the whole tree.'''
 
-        def PT(tree, node):
+        self.DrawRoot()
 
-            if node.daughters == None:
-                tree.DrawTip(node)
+        c = self.plot_vars
+        detail = self.detail
+        report = (detail == None and c.lod > 0)
+        if report:
+            self.detail = detail = PieDetail.Detail(self.layout, c, c.lod)
+        if detail != None:
+            forks = detail.forks
+        else:
+            forks = None
+
+        batch = (c.batch == "yes")
+        if batch:
+            self.DrawBranches()
+            if c.pieradius > 0:
+                self.DrawPies()
+
+        size = self.layout.size
+        for (i, node) in enumerate(self.layout.nodes):
+
+            if size[i] == 1:
+                if detail == None or i in detail.tips:
+                    self.DrawTip(node, i)
 
             else:
-                tree.DrawFork(node)
+                if not batch and (forks == None or i in forks):
+                    self.DrawFork(node, i)
 
-                if tree.plot_vars.pieradius > 0:
-                    if node.state != None:
-                        tree.DrawPie(node)
-                    else:
-                        print "NOTE: state not specified for %s" \
-                                % (node.label)
+                if c.pieradius > 0 and node.state != None:
+                    if not batch and (detail == None or i in detail.pies):
+                        self.DrawPie(node, i)
 
-                if tree.plot_vars.nodenamesize > 0:
-                    tree.DrawNodeLabel(node)
+                if c.nodenamesize > 0 and \
+                        (detail == None or i in detail.nodelabels):
+                    self.DrawNodeLabel(node, i)
 
-                for d in node.daughters:
-                    PT(tree, d)
+        if report:
+            detail.Report()
 
-        self.DrawRoot()
-        PT(self, self.root)
+    def Forks(self):
+        '''Return the set of nodes whose forks should be drawn, or None
+           for all of them.'''
+
+        if self.detail == None:
+            return None
+        return self.detail.forks
+
+    def Drawn(self):
+        '''Count the tips, forks, pies, and node labels that PlotTree
+           draws.'''
+
+        c = self.plot_vars
+        detail = self.detail
+        forks = self.Forks()
+        size = self.layout.size
+        counts = {"tips": 0, "forks": 0, "pies": 0, "node labels": 0}
+        for (i, node) in enumerate(self.layout.nodes):
+            if size[i] == 1:
+                if detail == None or i in detail.tips:
+                    counts["tips"] += 1
+                continue
+            if forks == None or i in forks:
+                counts["forks"] += 1
+            if c.pieradius > 0 and node.state != None and \
+                    (detail == None or i in detail.pies):
+                counts["pies"] += 1
+            if c.nodenamesize > 0 and node.label != None and \
+                    (detail == None or i in detail.nodelabels):
+                counts["node labels"] += 1
+        return counts
 
     def DrawTipMore(self, node, (x,y), delta):
         '''Finish the work of DrawTip.'''
 
         c = self.plot_vars
         cr = self.surface
+        detail = self.detail
+        drawbox = (detail == None or detail.tipboxes)
 
         # box border
-        if c.rimthick > 0 and c.boxsize > 0:
+        if drawbox and c.rimthick > 0 and c.boxsize > 0:
             cr.set_line_width(c.rimthick)
             cr.set_source_rgb(c.linecolor[0], c.linecolor[1], \
                     c.linecolor[2])
             cr.stroke_preserve()
 
-        # tip color
-        if node.state in range(self.nstates):
+        # tip color (gray if there is no state)
+        if node.state != None and 0 <= node.state < self.nstates:
             i = node.state
             cr.set_source_rgb(c.color[i][0], c.color[i][1], c.color[i][2])
         else:
             cr.set_source_rgb(0.5, 0.5, 0.5)
-            print "WARNING: check the state of %s" % node.label
-        cr.fill()
+        if drawbox:
+            cr.fill()
+        else:
+            cr.new_path()
 
         # tip label
-        if c.tipnamesize > 0:
+        if c.tipnamesize > 0 and (detail == None or detail.tiplabels):
             if c.tipnamestatecolor != "yes":
                 cr.set_source_rgb(c.textcolor[0], c.textcolor[1], \
                         c.textcolor[2])
-            cr.set_font_size(c.tipnamesize)
-            textheight = cr.text_extents(node.label)[3]
-            cr.move_to(x + delta/2. + c.tipspacing/4., y + textheight/3.)
+            text = self.text
+            text.SetSize(c.tipnamesize)
+            textheight = text.Extents(node.label)[3]
+            (x, y) = (x + delta/2. + c.tipspacing/4., y + textheight/3.)
             if c.underscorespace == "yes":
-                cr.show_text((node.label).replace("_", " "))
+                text.ShowAt(x, y, (node.label).replace("_", " "))
             else:
-                cr.show_text(node.label)
+                text.ShowAt(x, y, node.label)
 
     def DrawPieMore(self, node, (x,y)):
         '''Finish the work of DrawPie.'''
@@ -149,15 +226,87 @@ class PieTree():
             cr.stroke()
 
         # the pie pieces
-        angle_start = -pi/2
-        for i in range(self.nstates):
-            angle_stop = node.state[i] * 2 * pi + angle_start
+        for (i, angle_start, angle_stop) in self.PiePieces(node.state, 0):
             cr.set_source_rgb(c.color[i][0], c.color[i][1], c.color[i][2])
             cr.move_to(x, y)
             cr.arc(x, y, R, angle_start, angle_stop)
             cr.fill()
+
+    def PiePieces(self, state, turn):
+        '''Return the (state, start angle, stop angle) of each piece of
+           the pie for these state probabilities, starting from the top
+           and turned by turn.  With the level-of-detail option, pieces
+           too thin to see are merged into the piece before them.'''
+
+        detail = self.detail
+        pieces = []
+        angle_start = turn - pi/2
+        for i in range(self.nstates):
+            angle_stop = state[i] * 2 * pi + angle_start
+            if detail != None and angle_stop - angle_start < detail.minangle:
+                if angle_stop > angle_start:
+                    detail.culled["pie pieces"] += 1
+                if pieces:
+                    pieces[-1][2] = angle_stop
+            elif pieces or detail == None:
+                pieces.append([i, angle_start, angle_stop])
+            else:
+                # the first piece also covers any thin ones before it
+                pieces.append([i, turn - pi/2, angle_stop])
             angle_start = angle_stop
 
+        # if every piece is too thin, show the biggest
+        if not pieces:
+            i = max(range(self.nstates), key=lambda k: state[k])
+            pieces.append([i, turn - pi/2, angle_start])
+
+        return pieces
+
+    def DrawPies(self):
+        '''Draw the pie charts at all the nodes at once: one path for
+           all the rims, and one for each state color.'''
+
+        c = self.plot_vars
+        cr = self.surface
+        layout = self.layout
+        (cx, cy, size) = (layout.cx, layout.cy, layout.size)
+
+        R = c.pieradius
+
+        # the nodes with pies, and how far each pie is turned (radial pies
+        # are turned to face out from the center)
+        pies = []
+        detail = self.detail
+        for (i, node) in enumerate(layout.nodes):
+            if size[i] > 1 and node.state != None and \
+                    (detail == None or i in detail.pies):
+                if layout.polar:
+                    pies.append((i, node.state, layout.t[i]))
+                else:
+                    pies.append((i, node.state, 0))
+
+        # the outer circles of the pies
+        if c.rimthick > 0:
+            cr.set_line_width(c.rimthick)
+            cr.set_source_rgb(c.linecolor[0], c.linecolor[1], \
+                    c.linecolor[2])
+            for (i, state, turn) in pies:
+                cr.move_to(cx[i], cy[i])
+                cr.arc(cx[i], cy[i], R, turn, turn + 2*pi)
+            cr.stroke()
+
+        # the pie pieces, sorted by state and then drawn one state at a time
+        pieces = [[] for k in range(self.nstates)]
+        for (i, state, turn) in pies:
+            for (k, angle_start, angle_stop) in self.PiePieces(state, turn):
+                pieces[k].append((i, angle_start, angle_stop))
+        for k in range(self.nstates):
+            cr.set_source_rgb(c.color[k][0], c.color[k][1], c.color[k][2])
+            for (i, angle_start, angle_stop) in pieces[k]:
+                cr.move_to(cx[i], cy[i])
+                cr.arc(cx[i], cy[i], R, angle_start, angle_stop)
+            cr.fill()
+
     def DrawNodeLabelMore(self, node, (x,y)):
         '''Finish the work of DrawNodeLabel.'''
 
@@ -165,15 +314,16 @@ class PieTree():
         cr = self.surface
 
         cr.set_source_rgb(c.textcolor[0], c.textcolor[1], c.textcolor[2])
-        cr.set_font_size(c.nodenamesize)
+        text = self.text
+        text.SetSize(c.nodenamesize)
 
         if node.label != None:
-            textheight = cr.text_extents(node.label)[3]
-            cr.move_to(x + c.pieradius + c.tipspacing/5., y + textheight/2.)
+            textheight = text.Extents(node.label)[3]
+            (x, y) = (x + c.pieradius + c.tipspacing/5., y + textheight/2.)
             if c.underscorespace == "yes":
-                cr.show_text((node.label).replace("_", " "))
+                text.ShowAt(x, y, (node.label).replace("_", " "))
             else:
-                cr.show_text(node.label)
+                text.ShowAt(x, y, node.label)
 
     def DrawScalebar(self):
         '''Display the time scale.'''
@@ -186,11 +336,12 @@ class PieTree():
 
         # size of the label
         showme = str(c.scalebar["length"])
-        tw = (cr.text_extents(showme)[2], cr.text_extents(showme)[3])
+        tw = self.text.Extents(showme)[2:4]
         # note: "%.*e" % (n-1, x) rounds to n digits
 
-        x0 = self.Xform( (self.root.x, 0) )[0]
-        x1 = self.Xform( (self.root.x + c.scalebar["length"], 0) )[0]
+        rootx = self.layout.x[0]
+        x0 = self.Xform( (rootx, 0) )[0]
+        x1 = self.Xform( (rootx + c.scalebar["length"], 0) )[0]
         y = c.height - c.ymargin/2
         y0 = y - tw[1]
         y1 = y + tw[1]
@@ -209,9 +360,20 @@ class PieTree():
         cr.stroke()
 
         # label
-        cr.move_to((x0 + x1) / 2. - tw[0], y0)
-        cr.set_font_size(c.scalebar["textsize"])
-        cr.show_text(showme)
+        self.text.SetSize(c.scalebar["textsize"])
+        self.text.ShowAt((x0 + x1) / 2. - tw[0], y0, showme)
+
+
+def MakeTree(c, root, ntips, nstates, surface, text=None):
+    '''Return a PieTree of the shape given by the options in c.'''
+
+    if c.shape == "rect":
+        return PieTreeRect(root, ntips, nstates, surface, c, text)
+    elif c.shape == "radial":
+        return PieTreeRadial(root, ntips, nstates, surface, c, text)
+    else:    # this should never happen, but just in case...
+        raise PieTreeError("tree shape not found")
+
 
 
 #--------------------------------------------------
@@ -221,93 +383,101 @@ class PieTree():
 class PieTreeRect(PieTree):
     '''For plotting a rectangularly-oriented tree.'''
 
-    def CalcXY(self, tipsize):
-        '''Compute the (x, y) coordinate for each tip and node.
-           These are stored as .x and .y node attributes.
-           Also store horizontal scaling info as .xmax and .xscale.'''
-
-        # todo: extract answer by using return rather than list
-        def CXY(node, x, i, xmax):
-
-            if node.length != None:
-                x += node.length
-            node.x = x
+    def LayoutKey(self, tipsize):
+        '''The options that Place depends on.'''
 
-            if x > xmax[0]:
-                xmax[0] = x
-
-            if node.daughters != None:
-                for d in node.daughters:
-                    i = CXY(d, x, i, xmax)
-
-            if node.daughters == None:
-                node.y = i
-                i += 1
-            else:
-                sum_y = 0.0
-                for d in node.daughters:
-                    sum_y += d.y
-                node.y = sum_y / len(node.daughters)
+        c = self.plot_vars
+        return ("rect", c.width, c.xmargin, c.ymargin, c.tipspacing, \
+                c.pieradius, c.linethick, tipsize)
 
-            return i
+    def Place(self, layout, tipsize):
+        '''Compute the (x, y) coordinate for each tip and node, and their
+           canvas coordinates, in the layout.'''
 
         c = self.plot_vars
 
-        xmax = [-1]
-        CXY(self.root, 0, 0.5, xmax)
-        c.xmax = xmax[0]
-        c.xscale = (c.width - 2*c.xmargin - c.tipspacing - tipsize - \
-                c.pieradius) / c.xmax
+        # x accumulates branch lengths down from the root; tips are evenly
+        # spaced in y; nodes are centered over their daughters
+        layout.xmax = layout.Rect()
+        layout.xscale = (c.width - 2*c.xmargin - c.tipspacing - tipsize - \
+                c.pieradius) / layout.xmax
+
+        layout.Canvas(layout.xscale, c.xmargin + c.pieradius + c.linethick, \
+                c.tipspacing, c.ymargin)
 
     def Xform(self, (x,y)):
         '''Transform (x, y) coordinates from tree to canvas.'''
 
         c = self.plot_vars
-        return(c.xmargin + c.pieradius + c.linethick + x * c.xscale, \
-                c.ymargin + y * c.tipspacing)
+        return(c.xmargin + c.pieradius + c.linethick + \
+                x * self.layout.xscale, c.ymargin + y * c.tipspacing)
 
-    def DrawTip(self, node):
+    def DrawTip(self, node, i):
         '''Draw the tip box, border, and label.'''
 
         c = self.plot_vars
         cr = self.surface
 
         # the tip box
-        (x, y) = self.Xform( (node.x, node.y) )
+        (x, y) = (self.layout.cx[i], self.layout.cy[i])
         delta = c.boxsize
         cr.rectangle(x - delta/2., y-delta/2., delta, delta)
 
         # everything else
         self.DrawTipMore(node, (x,y), delta)
 
-    def DrawPie(self, node):
+    def DrawPie(self, node, i):
         '''Draw the pie chart at this node.'''
 
-        xy = self.Xform( (node.x, node.y) )
+        xy = (self.layout.cx[i], self.layout.cy[i])
         self.DrawPieMore(node, xy) 
 
-    def DrawFork(self, node):
+    def DrawFork(self, node, i):
         '''Draw the fork to this node's daughters.'''
 
         c = self.plot_vars
         cr = self.surface
+        layout = self.layout
 
         cr.set_line_width(c.linethick)
         cr.set_source_rgb(c.linecolor[0], c.linecolor[1], c.linecolor[2])
 
-        (x0, y0) = self.Xform( (node.x, node.y) )
+        (x0, y0) = (layout.cx[i], layout.cy[i])
 
-        for d in node.daughters:
-            (x, y) = self.Xform( (d.x, d.y) )
+        for j in layout.Daughters(i):
+            (x, y) = (layout.cx[j], layout.cy[j])
             cr.move_to(x0, y0)
             cr.line_to(x0, y)
             cr.line_to(x, y)
             cr.stroke()
 
-    def DrawNodeLabel(self, node):
+    def DrawBranches(self):
+        '''Draw the forks of the whole tree as one path.'''
+
+        c = self.plot_vars
+        cr = self.surface
+        layout = self.layout
+        (cx, cy) = (layout.cx, layout.cy)
+
+        cr.set_line_width(c.linethick)
+        cr.set_source_rgb(c.linecolor[0], c.linecolor[1], c.linecolor[2])
+
+        # from each node's parent, down (or up) and across to the node
+        parent = layout.parent
+        forks = self.Forks()
+        for j in xrange(1, len(parent)):
+            p = parent[j]
+            if forks != None and p not in forks:
+                continue
+            cr.move_to(cx[p], cy[p])
+            cr.line_to(cx[p], cy[j])
+            cr.line_to(cx[j], cy[j])
+        cr.stroke()
+
+    def DrawNodeLabel(self, node, i):
         '''Put the text label by this node.'''
 
-        xy = self.Xform( (node.x, node.y) )
+        xy = (self.layout.cx[i], self.layout.cy[i])
         self.DrawNodeLabelMore(node, xy)
 
     def DrawRoot(self):
@@ -316,8 +486,8 @@ class PieTreeRect(PieTree):
         c = self.plot_vars
         cr = self.surface
 
-        (x0, y) = self.Xform( (0, self.root.y) )
-        (x, y) = self.Xform( (self.root.x, self.root.y) )
+        (x0, y) = self.Xform( (0, self.layout.y[0]) )
+        (x, y) = (self.layout.cx[0], self.layout.cy[0])
 
         cr.set_line_width(c.linethick)
         cr.set_source_rgb(c.linecolor[0], c.linecolor[1], c.linecolor[2])
@@ -333,75 +503,46 @@ class PieTreeRect(PieTree):
 class PieTreeRadial(PieTree):
     '''For plotting a radially-oriented tree.'''
 
-    def CalcXY(self, tipsize):
-        '''Compute the (x, y) and (r, theta) coordinate for each tip 
-           and node.  These are stored as node attributes .x .y .r .t.
-           Also store horizontal scaling info as .xmax and .xscale.'''
-
-        def CalcRT(node, r, i, rmax, ntips):
-            '''Compute the (r, theta) coordinates for each tip and node.
-               These are stored as .r and .t attributes.'''
-
-            if node.length != None:
-                r += node.length
-            node.r = r
+    def LayoutKey(self, tipsize):
+        '''The options that Place depends on.'''
 
-            if r > rmax[0]:
-                rmax[0] = r
-
-            if node.daughters != None:
-                for d in node.daughters:
-                    i = CalcRT(d, r, i, rmax, ntips)
-
-            if node.daughters == None:
-                node.t = 2 * pi * i / ntips
-                i += 1
-            else:
-                sum_t = 0.0
-                for d in node.daughters:
-                    sum_t += d.t
-                node.t = sum_t / len(node.daughters)
-
-            return i
-
-        def RTtoXY(node):
-            '''Convert polar to Cartesian coordinates.'''
-
-            if node.daughters != None:
-                for d in node.daughters:
-                    RTtoXY(d)
+        c = self.plot_vars
+        return ("radial", c.width, c.height, c.xmargin, c.tipspacing, \
+                c.pieradius, tipsize)
 
-            node.x = node.r * cos(node.t)
-            node.y = node.r * sin(node.t)
+    def Place(self, layout, tipsize):
+        '''Compute the (x, y) and (r, theta) coordinate for each tip 
+           and node, and their canvas coordinates, in the layout.'''
 
         c = self.plot_vars
 
-        rmax = [-1]
-        CalcRT(self.root, 0, 0, rmax, self.ntips)
-        RTtoXY(self.root)
+        # r accumulates branch lengths out from the root; tips are evenly
+        # spaced in theta; nodes are centered over their daughters
+        layout.xmax = layout.Radial(self.ntips) * 2
+        layout.xscale = (c.width - 2*c.xmargin - 2*c.tipspacing - \
+                2*tipsize - 2*c.pieradius) / layout.xmax
 
-        c.xmax = rmax[0] * 2
-        c.xscale = (c.width - 2*c.xmargin - 2*c.tipspacing - 2*tipsize - \
-                2*c.pieradius) / c.xmax
+        layout.Canvas(layout.xscale, c.width/2., layout.xscale, c.height/2.)
 
     def Xform(self, (x,y)):
         '''transform (x, y) coordinates from tree to canvas'''
 
         c = self.plot_vars
-        return (x * c.xscale + c.width/2., y * c.xscale + c.height/2.)
+        xscale = self.layout.xscale
+        return (x * xscale + c.width/2., y * xscale + c.height/2.)
 
-    def DrawTip(self, node):
+    def DrawTip(self, node, i):
         '''Draw the tip box, border, and label.'''
 
         c = self.plot_vars
         cr = self.surface
 
         # the tip box
-        (x, y) = self.Xform( (node.x, node.y) )
+        (x, y) = (self.layout.cx[i], self.layout.cy[i])
         delta = c.boxsize
         m = cr.get_matrix()  # for rotation, with set_matrix below
         cr.translate(x, y)
-        cr.rotate(node.t)
+        cr.rotate(self.layout.t[i])
         cr.rectangle(0, -delta/2., delta, delta)
 
         # everything else
@@ -409,61 +550,94 @@ class PieTreeRadial(PieTree):
 
         cr.set_matrix(m)
 
-    def DrawPie(self, node):
+    def DrawPie(self, node, i):
         '''Draw the pie chart at this node.'''
 
         cr = self.surface
 
-        (x, y) = self.Xform( (node.x, node.y) )
+        (x, y) = (self.layout.cx[i], self.layout.cy[i])
         m = cr.get_matrix()  # for rotation, with set_matrix below
         cr.translate(x, y)
-        cr.rotate(node.t)
+        cr.rotate(self.layout.t[i])
 
         self.DrawPieMore(node, (0,0)) 
 
         cr.set_matrix(m)
 
-    def DrawFork(self, node):
+    def DrawFork(self, node, i):
         '''Draw the fork to this node's daughters.'''
 
         c = self.plot_vars
         cr = self.surface
+        layout = self.layout
 
         cr.set_line_width(c.linethick)
         cr.set_source_rgb(c.linecolor[0], c.linecolor[1], c.linecolor[2])
         cr.set_line_cap(cairo.LINE_CAP_ROUND)
 
-        (x0, y0) = self.Xform( (node.x, node.y) )
-
         (mint, maxt) = (2*pi, 0)
-        for d in node.daughters:
-
-            if d.t < mint:
-                mint = d.t
-            if d.t > maxt:
-                maxt = d.t
+        for j in layout.Daughters(i):
 
-            (xd, yd) = self.Xform( (d.x, d.y) )
-            xa = node.r * cos(d.t)
-            ya = node.r * sin(d.t)
-            (xb, yb) = self.Xform( (xa, ya) )
+            t = layout.t[j]
+            if t < mint:
+                mint = t
+            if t > maxt:
+                maxt = t
 
-            cr.move_to(xd, yd)
-            cr.line_to(xb, yb)
+            # from the daughter in to the arc through this node
+            cr.move_to(layout.cx[j], layout.cy[j])
+            cr.line_to(layout.bx[j], layout.by[j])
             cr.stroke()
 
-        cr.arc(c.width/2., c.height/2., node.r*c.xscale, mint, maxt)
+        cr.arc(c.width/2., c.height/2., layout.r[i]*layout.xscale, mint, maxt)
+        cr.stroke()
+
+    def DrawBranches(self):
+        '''Draw the forks of the whole tree as one path.'''
+
+        c = self.plot_vars
+        cr = self.surface
+        layout = self.layout
+        (t, parent, size) = (layout.t, layout.parent, layout.size)
+
+        cr.set_line_width(c.linethick)
+        cr.set_source_rgb(c.linecolor[0], c.linecolor[1], c.linecolor[2])
+        cr.set_line_cap(cairo.LINE_CAP_ROUND)
+
+        # from each node in to the arc through its parent, noting how far
+        # round each arc has to go
+        n = len(parent)
+        mint = [2*pi] * n
+        maxt = [0] * n
+        forks = self.Forks()
+        for j in xrange(1, n):
+            p = parent[j]
+            if forks != None and p not in forks:
+                continue
+            if t[j] < mint[p]:
+                mint[p] = t[j]
+            if t[j] > maxt[p]:
+                maxt[p] = t[j]
+            cr.move_to(layout.cx[j], layout.cy[j])
+            cr.line_to(layout.bx[j], layout.by[j])
+
+        # the arcs; each is a new piece of the path, not joined to the last
+        for i in xrange(n):
+            if size[i] > 1 and (forks == None or i in forks):
+                cr.new_sub_path()
+                cr.arc(c.width/2., c.height/2., layout.r[i]*layout.xscale, \
+                        mint[i], maxt[i])
         cr.stroke()
 
-    def DrawNodeLabel(self, node):
+    def DrawNodeLabel(self, node, i):
         '''Put the text label by this node.'''
 
         cr = self.surface
 
-        (x, y) = self.Xform( (node.x, node.y) )
+        (x, y) = (self.layout.cx[i], self.layout.cy[i])
         m = cr.get_matrix()  # for rotation, with set_matrix below
         cr.translate(x, y)
-        cr.rotate(node.t)
+        cr.rotate(self.layout.t[i])
 
         self.DrawNodeLabelMore(node, (0, 0) )
 
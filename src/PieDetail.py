@@ -0,0 +1,132 @@
+#! /usr/bin/env python
+
+#--------------------------------------------------
+# Copyright 2008 Emma Goldberg
+#
+# This file is part of PieTree.
+#
+# PieTree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PieTree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PieTree.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------
+
+######################################################
+# Module:  PieDetail.py
+######################################################
+
+'''
+Level of detail: decide which pies, tip boxes, and labels are worth
+drawing at the size of the picture, or in one part of the picture.
+
+Anything smaller than the threshold (in pixels, or points for vector
+output) is not drawn at all.  Of several things closer together than the
+threshold, only the one that would end up on top is drawn.  Pie pieces
+narrower than the threshold at the rim are merged into their neighbor.
+'''
+
+from PieError import Message
+
+
+class Detail(object):
+    '''
+        What to leave out of one picture, for a threshold of lod pixels.
+          pies, tips, nodelabels: sets of the (preorder) indices of the
+                nodes whose pie, tip (box and label), or node label is drawn
+          tipboxes, tiplabels: whether tip boxes and labels are big enough
+                to be drawn at all
+          forks: set of the indices of the nodes whose fork (the lines to
+                its daughters) is drawn, or None for all of them
+          minangle: the narrowest pie piece that is drawn on its own
+          culled: how many of each kind of thing were left out
+        To draw only part of the picture, give the nodes whose pie, box, or
+        label might be in that part (in preorder), and the forks that are.
+        With lod = 0, nothing is left out for being too small.
+    '''
+
+    def __init__(self, layout, c, lod, nodes=None, forks=None):
+        self.lod = lod
+        self.forks = forks
+        self.culled = {"pies": 0, "tip boxes": 0, "tip labels": 0, \
+                "node labels": 0, "pie pieces": 0}
+
+        tips = []
+        pies = []
+        labels = []
+        if nodes == None:
+            nodes = xrange(len(layout.nodes))
+        for i in nodes:
+            node = layout.nodes[i]
+            if layout.size[i] == 1:
+                tips.append(i)
+            else:
+                if node.state != None:
+                    pies.append(i)
+                if node.label != None:
+                    labels.append(i)
+
+        self.tipboxes = c.boxsize >= lod
+        self.tiplabels = c.tipnamesize >= lod
+        if self.tipboxes or self.tiplabels:
+            self.tips = self.Spread(layout, tips)
+        else:
+            self.tips = set()
+
+        if c.pieradius > 0 and 2 * c.pieradius >= lod:
+            self.pies = self.Spread(layout, pies)
+            self.minangle = float(lod) / c.pieradius
+        else:
+            self.pies = set()
+            self.minangle = 0
+
+        if c.nodenamesize >= lod:
+            self.nodelabels = self.Spread(layout, labels)
+        else:
+            self.nodelabels = set()
+
+        culled = self.culled
+        ntips = len(tips) - len(self.tips)
+        if c.boxsize > 0:
+            culled["tip boxes"] = ntips if self.tipboxes else len(tips)
+        if c.tipnamesize > 0:
+            culled["tip labels"] = ntips if self.tiplabels else len(tips)
+        if c.pieradius > 0:
+            culled["pies"] = len(pies) - len(self.pies)
+        if c.nodenamesize > 0:
+            culled["node labels"] = len(labels) - len(self.nodelabels)
+
+    def Spread(self, layout, nodes):
+        '''
+        Of the given nodes, return the set that are at least the threshold
+        apart: the canvas is divided into squares of that size, and only the
+        last node drawn in each square (the one that would be on top) is
+        kept.
+        '''
+
+        lod = self.lod
+        if lod <= 0:
+            return set(nodes)
+        (cx, cy) = (layout.cx, layout.cy)
+        cells = {}
+        for i in nodes:
+            cells[(int(cx[i] // lod), int(cy[i] // lod))] = i
+        return set(cells.itervalues())
+
+    def Report(self):
+        '''Say how much was left out.'''
+
+        culled = self.culled
+        kinds = [kind for kind in ("pies", "pie pieces", "tip boxes", \
+                "tip labels", "node labels") if culled[kind] > 0]
+        if kinds:
+            Message("NOTE: too small to see at this size, not drawn: " + \
+                    ", ".join(["%d %s" % (culled[kind], kind) \
+                    for kind in kinds]))
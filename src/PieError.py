@@ -34,3 +34,50 @@ class PieTreeError(Exception):
     def __str__(self):
         if self.value:
             return repr(self.value)
+
+
+# Warnings and notes go through Message, so that a program using PieTree
+# as a library can decide where they go.  By default they are printed.
+
+_hook = None
+
+def Message(text):
+    '''Pass on a warning or note for the user.'''
+
+    if _hook == None:
+        print text
+    else:
+        _hook(text)
+
+def SetMessageHook(hook):
+    '''
+    Send messages to hook(text) instead of printing them, or print them
+    again if hook is None.  Returns the previous hook.
+    '''
+
+    global _hook
+    old = _hook
+    _hook = hook
+    return old
+
+
+class KeepMessages(object):
+    '''
+    Within a with block, keep a copy of each message in a list (which the
+    with statement gives), as well as passing it on.
+    '''
+
+    def __enter__(self):
+        self.messages = []
+        self.old = SetMessageHook(self.Keep)
+        return self.messages
+
+    def __exit__(self, kind, value, traceback):
+        SetMessageHook(self.old)
+
+    def Keep(self, text):
+        self.messages.append(text)
+        if self.old == None:
+            print text
+        else:
+            self.old(text)
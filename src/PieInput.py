@@ -33,36 +33,54 @@ Set sensible default values.
 
 import sys
 import os
+import re
 import argparse
 import ConfigParser
 
-from PieError import PieTreeError
+from PieError import PieTreeError, Message
 import PieReadTree
+import PieProfile
+
+
+class _Parser(argparse.ArgumentParser):
+    '''An ArgumentParser that raises PieTreeError instead of exiting.'''
+
+    def error(self, message):
+        Message(self.format_usage().rstrip())
+        raise PieTreeError(message)
+
+
+FORMAT_CHOICES = ("pdf", "eps", "svg", "png", "tiles")
 
 
 # In the opt file, the first line should be [pietree].  Instead, to fake the config file section header, see http://stackoverflow.com/questions/2819696/parsing-properties-file-in-python/2819788#2819788
 
-def ParseInput():
-    '''get all the user's specifications'''
+def ParseInput(argv=None, readtree=None, tree=None, cachedefault="yes"):
+    '''
+    get all the user's specifications
+    Returns a list of jobs (one namespace of options for each picture to be
+    drawn), and the tree, ntips, and nstates that they all share.
+    argv is the list of command line arguments (default sys.argv[1:]).
+    readtree(treefile, compact, cache) returns (root, nstates), like
+    PieReadTree.ReadFromFileTTN (the default); a long-running caller can
+    give one that keeps trees that have already been read.
+    tree, if given, is a (root, nstates) pair to draw instead of reading
+    the treefile.
+    cachedefault is the cache option when it isn't given.
+    '''
+
+    if argv == None:
+        argv = sys.argv[1:]
+    if readtree == None:
+        readtree = PieReadTree.ReadFromFileTTN
 
     # First, we need just the tree input file.  This is required up front to
     # determine how many states are being used.  We should look for the name
     # of this file in both the options/config file, if any, and on the command
     # line.
 
-    parser1 = argparse.ArgumentParser(add_help=False)
-
-    parser1.add_argument('--version', action='version', \
-            version="PieTree 0.4, Nov 2011")
-
-    parser1.add_argument("--treefile", \
-            help="TTN file with tree and states")
-
-    parser1.add_argument("--optfile", \
-            help="config file containing options")
-
-    (ap, remaining_argv) = parser1.parse_known_args()
-    # can add an argument to be used instead of sys.argv -- might want to send this in with ParseInput, to facilitate testing and auto-generating docs
+    parser1 = EarlyParser()
+    (ap, remaining_argv) = parser1.parse_known_args(argv)
 
     # ap = input read by argparse
     # cp = input read by ConfigParse
@@ -71,14 +89,20 @@ def ParseInput():
 
     if ap.optfile:
         config = ConfigParser.SafeConfigParser()
-        config.read(ap.optfile)
+        try:
+            config.read(ap.optfile)
+        except ConfigParser.Error, error:
+            raise PieTreeError('Can\'t read the config file "' + \
+                    ap.optfile + '": ' + str(error))
         try:
             cp = dict(config.items("pietree"))
         except ConfigParser.NoSectionError:
             raise PieTreeError('The first line of the config file "' + \
                     ap.optfile + '" must be: [pietree]')
+        job_cps = ReadJobSections(config, cp)
     else:
         cp = {}
+        job_cps = [(None, cp)]
     # note: cp contains everything in the config file, potentially including
     # irrelevant options
 
@@ -90,90 +114,320 @@ def ParseInput():
     else:
         treefile = None
 
-    if treefile:
-        (root, nstates) = PieReadTree.ReadFromFileTTN(treefile)
-        if not root:
-            errmsg = 'Failed to read tree from file "' + treefile + '"'
-            nstates = 0
-            ntips = 0
-            age = 0
-        else:
-            ntips = PieReadTree.CountTips(root)
-            PieReadTree.AssignNodeTimes(root)
-            age = root.Age()
+    compact = EarlyChoice(ap, cp, "compact", "no")
+    cache = EarlyChoice(ap, cp, "cache", cachedefault)
+
+    if ap.workers != None:
+        workers = ap.workers
     else:
-        root = None
-        errmsg = "treefile not specified"
-        nstates = 0
-        ntips = 0
-        age = 0
-
-    # Now that we know how many states there are, we can parse the rest of the
-    # options.  (The number of states was really only needed to know how many
-    # state colors to look for.)
-
-    # the real parser, inheriting from the initial one used above
-    parser = argparse.ArgumentParser(parents=[parser1], \
-            description=__doc__)
-            #formatter_class=argparse.RawDescriptionHelpFormatter)
-
-    # add most of the input options
-    format_choices = ("pdf", "eps", "svg", "png")
-    AddParserArgs(parser, nstates, format_choices)
-
-    # merge config file and command line options
-    if cp:
-        parser.set_defaults(**cp)
-        # note: ** unpacks the dictionary into separate arguments
-    ap = parser.parse_args(remaining_argv)
-    SetDefaults(ap, ntips, age)
-
-    # adjust the outfile name and outformat as necessary
-    suffix = ap.outfile.split(".")[-1]
-
-    if suffix.lower() not in format_choices:
-        if ap.outformat == None:
-            ap.outformat = "pdf"
-        ap.outfile = ap.outfile + "." + ap.outformat
+        try:
+            workers = int(cp.get("workers", 1))
+        except ValueError:
+            raise PieTreeError("workers should be a number")
 
+    dryrun = EarlyChoice(ap, cp, "dryrun", "no")
+
+    if ap.profile != None:
+        profile = ap.profile
     else:
-        if ap.outformat == None:
-            ap.outformat = suffix.lower()
-        elif suffix.lower() != ap.outformat:
-            print "WARNING: outfile suffix (%s) and " % (suffix),
-            print "outformat (%s) don't match" % (ap.outformat)
+        profile = cp.get("profile")
+
+    watch = EarlyChoice(ap, cp, "watch", "no")
+
+    # Parse the rest of the options before reading the tree, so that --help
+    # and bad options are answered right away.  The number of states (and so
+    # the number of state colors) isn't known yet, so any --colorN is
+    # accepted; DrawJob checks that each state has a color.
+
+    # the real parser, inheriting from the initial one used above; one for
+    # each job, with that job's config file options as its defaults
+    jobs = []
+    optfile = ap.optfile
+    for (name, job_cp) in job_cps:
+        parser = _Parser(parents=[parser1], \
+                description=__doc__)
+                #formatter_class=argparse.RawDescriptionHelpFormatter)
+
+        # add most of the input options
+        AddParserArgs(parser, FORMAT_CHOICES)
+
+        # merge config file and command line options
+        if job_cp:
+            parser.set_defaults(**job_cp)
+            # note: ** unpacks the dictionary into separate arguments
+        ap = ParseWithColors(parser, remaining_argv)
+        ap.job = name
+        ap.treefile = treefile
+        ap.optfile = optfile
+        ap.workers = workers
+        ap.dryrun = dryrun
+        ap.profile = profile
+        ap.watch = watch
+
+        # adjust the outfile name and outformat as necessary
+        suffix = ap.outfile.split(".")[-1]
+
+        if ap.outfile == "-":
+            # standard output
+            if ap.outformat == None:
+                ap.outformat = "pdf"
+
+        elif ap.outformat == "tiles":
+            # a directory, named just as given, suffix and all
+            pass
+
+        elif suffix.lower() not in FORMAT_CHOICES:
+            if ap.outformat == None:
+                ap.outformat = "pdf"
             ap.outfile = ap.outfile + "." + ap.outformat
 
-    # Abort if critical input is missing.  (Can't do this earlier because need
-    # to prepare arguments for help message.)
+        else:
+            if ap.outformat == None:
+                ap.outformat = suffix.lower()
+            elif suffix.lower() != ap.outformat:
+                Message("WARNING: outfile suffix (%s) and " % (suffix) + \
+                        "outformat (%s) don't match" % (ap.outformat))
+                ap.outfile = ap.outfile + "." + ap.outformat
+
+        jobs.append(ap)
+
+    # a dry run stops short of the tree
+    if dryrun == "yes":
+        return (jobs, None, 0, 0)
+
+    # Now read the tree, timing it if asked.
+    if profile != None:
+        PieProfile.Start()
+    if tree != None:
+        (root, nstates) = tree
+        errmsg = "no tree given"
+    elif treefile:
+        (root, nstates) = readtree(treefile, compact == "yes", \
+                cache == "yes")
+        errmsg = 'Failed to read tree from file "' + treefile + '"'
+    else:
+        root = None
+        errmsg = "treefile not specified"
+
+    # Abort if critical input is missing.
     if not root:
-        parser.print_usage()
-        if len(sys.argv) > 1:
+        Message(parser.format_usage().rstrip())
+        if len(argv) > 0:
             raise PieTreeError(errmsg)
         else:
             raise PieTreeError(None)
 
-    return (ap, root, ntips, nstates)
+    # the tips are counted in the same pass that finds the tree's age,
+    # which sets the length of an automatic scale bar
+    with PieProfile.Phase("count tips"):
+        ntips = PieReadTree.CountTips(root)
+        age = root.Age()
+    # a tree read from the treefile gets its node times, as it always has
+    if tree == None:
+        with PieProfile.Phase("node times"):
+            PieReadTree.AssignNodeTimes(root)
+    PieProfile.Count("tips", ntips)
+    PieProfile.Count("states", nstates)
+    for c in jobs:
+        SetDefaults(c, ntips, age)
+
+    return (jobs, root, ntips, nstates)
+
+
+def ParseOptions(options, tree=None, readtree=None):
+    '''
+    Get the options for one picture from a dictionary instead of the
+    command line.  Keys are option names without the --, such as
+    "treefile" or "shape"; values can be strings or numbers, tuples for
+    colors, and True or False for yes and no.  The key "job" picks a
+    section of the optfile (default: the first job).  A name that isn't an
+    option, or that only begins one, is an error.  The cache option is
+    "no" unless given.
+    tree, if given, is the root of a tree whose states are already in
+    place, to draw instead of the treefile.
+    Returns the options and the tree, ntips, and nstates, as one job of
+    ParseInput.
+    '''
+
+    # names are checked here, since argparse would take any prefix of an
+    # option (so "hel" would be --help)
+    names = OptionNames()
+    argv = []
+    job = None
+    for (name, value) in options.items():
+        if name == "job":
+            job = value
+            continue
+        if name in ("help", "version", "dryrun", "profile", "watch"):
+            raise PieTreeError('"' + name + '" is not a drawing option')
+        if name not in names and not _color_name.match(name):
+            raise PieTreeError('"' + name + '" is not an option')
+        if value is True:
+            value = "yes"
+        elif value is False:
+            value = "no"
+        argv.append("--" + name + "=" + str(value))
+    if tree == None and not argv:
+        raise PieTreeError("treefile not specified")
+
+    if tree != None:
+        tree = (tree, PieReadTree.CountStates(tree))
+    # no snapshots are written unless asked for, from within Python
+    (jobs, root, ntips, nstates) = ParseInput(argv, readtree, tree, "no")
+
+    if job == None:
+        return (jobs[0], root, ntips, nstates)
+    for c in jobs:
+        if c.job == job:
+            return (c, root, ntips, nstates)
+    raise PieTreeError('job "' + job + '" not found')
+
+
+def ReadJobSections(config, cp):
+    '''
+    Every section of the config file besides [pietree] describes a separate
+    job (picture), which starts with the [pietree] options and adds to or
+    changes them.  Return a list of (section name, options) pairs, one per
+    job; with no other sections, [pietree] itself is the only job.
+    '''
+
+    job_cps = []
+    for section in config.sections():
+        if section == "pietree":
+            continue
+        job_cp = dict(cp)
+        job_cp.update(config.items(section))
+
+        # these are used to read the tree, which all the jobs share
+        for name in ("treefile", "compact", "cache", "workers", "dryrun", \
+                "profile", "watch"):
+            if job_cp.get(name) != cp.get(name):
+                raise PieTreeError('"' + name + '" should only be set in ' + \
+                        'the [pietree] section, not in [' + section + ']')
+
+        job_cps.append((section, job_cp))
+
+    if not job_cps:
+        job_cps.append((None, cp))
+    return job_cps
+
+
+def EarlyParser():
+    '''
+    Return a parser for the options needed before anything else: the tree
+    and config files, and the choices about how the tree is read and how
+    the jobs are run.
+    '''
+
+    parser = _Parser(add_help=False)
+
+    parser.add_argument('--version', action='version', \
+            version="PieTree 0.4, Nov 2011")
+
+    parser.add_argument("--treefile", \
+            help="TTN file with tree and states (- for standard input)")
 
+    parser.add_argument("--optfile", \
+            help="config file containing options")
 
-def AddParserArgs(parser, nstates, format_choices):
+    yesno_choices = ("yes", "no")
+    parser.add_argument("--compact", \
+            choices = yesno_choices, help="if the tree should be stored " + \
+            "in compact arrays, to save memory on huge trees [" + \
+            ", ".join(yesno_choices) + "]")
+    parser.add_argument("--cache", \
+            choices = yesno_choices, help="if a binary snapshot of the " + \
+            "tree file should be kept and reused [" + \
+            ", ".join(yesno_choices) + "]")
+
+    parser.add_argument("--workers", type=int, \
+            help="number of processes drawing the jobs of the config file")
+
+    parser.add_argument("--dryrun", \
+            choices = yesno_choices, help="if the options should only be " + \
+            "checked, saying what would be drawn without reading the " + \
+            "tree [" + ", ".join(yesno_choices) + "]")
+
+    parser.add_argument("--profile", \
+            help="file to which the time and memory taken by each phase " + \
+            "of the run are written, as JSON (- for standard output)")
+
+    parser.add_argument("--watch", \
+            choices = yesno_choices, help="if the pictures should be " + \
+            "drawn again whenever the treefile or optfile changes, " + \
+            "until interrupted [" + ", ".join(yesno_choices) + "]")
+
+    return parser
+
+
+def OptionNames():
+    '''Return the set of option names, without the --.'''
+
+    parser = _Parser(parents=[EarlyParser()])
+    AddParserArgs(parser, FORMAT_CHOICES)
+    return set([option[2:] for option in parser._option_string_actions \
+            if option.startswith("--")])
+
+
+def EarlyChoice(ap, cp, name, default):
+    '''
+    Get a yes/no option that is needed before the tree is read; the command
+    line takes precedence over the config file.
+    '''
+
+    value = getattr(ap, name)
+    if value == None:
+        value = cp.get(name, default)
+    if value not in ("yes", "no"):
+        raise PieTreeError(name + ' should be "yes" or "no"')
+    return value
+
+
+def ParseWithColors(parser, argv):
+    '''
+    Parse the command line arguments, also accepting --colorN (or
+    --colorN=value) for any state N.
+    '''
+
+    (ap, extra) = parser.parse_known_args(argv)
+    k = 0
+    while k < len(extra):
+        match = _color_option.match(extra[k])
+        if match == None:
+            parser.error("unrecognized arguments: " + " ".join(extra[k:]))
+        if match.group(3) != None:
+            value = match.group(3)
+        elif k + 1 < len(extra):
+            k += 1
+            value = extra[k]
+        else:
+            parser.error("argument " + extra[k] + ": expected one argument")
+        setattr(ap, match.group(1), value)
+        k += 1
+    return ap
+
+_color_option = re.compile(r"--(color[0-9]+)(=(.*))?$")
+_color_name = re.compile(r"color[0-9]+$")
+
+
+def AddParserArgs(parser, format_choices):
     '''Set the main input options (besides treefile, optfile)'''
 
-    if nstates == 0:
-        parser.add_argument("--colorX", help="color of state X " \
-                "(specify for each of states = 0, 1, etc.): (red, green, blue) triplet")
-    else:
-        for i in range(nstates):
-            parser.add_argument("--color"+str(i), \
-                    help="color of state "+str(i)+": (red, green, blue) triplet")
+    # only for the help message; see ParseWithColors
+    parser.add_argument("--colorX", help="color of state X " \
+            "(specify for each of states = 0, 1, etc.): (red, green, blue) triplet")
 
     parser.add_argument("--outfile", \
-            help="file to which the resulting image is written")
+            help="file to which the resulting image is written " + \
+            "(- for standard output)")
 
     parser.add_argument("--outformat", \
             choices = format_choices, help="image type to be created [" + 
             ", ".join(format_choices) + "]")
 
+    parser.add_argument("--tilesize", type=int, \
+            help="width and height of each tile, for outformat tiles")
+
     shape_choices = ("rect", "radial")
     parser.add_argument("--shape", choices = shape_choices, \
             help="tree shape [" + ", ".join(shape_choices) + "]")
@@ -230,6 +484,14 @@ def AddParserArgs(parser, nstates, format_choices):
     parser.add_argument("--scalebar", \
             help="display the temporal scale [yes, no, number]")
 
+    parser.add_argument("--lod", type=float, \
+            help="leave out pies, tip boxes, and labels smaller or " + \
+            "closer together than this many pixels (0 to draw everything)")
+    parser.add_argument("--batch", \
+            choices = yesno_choices, help="if all lines of the same " + \
+            "style should be drawn together, which is faster for big " + \
+            "trees [" + ", ".join(yesno_choices) + "]")
+
     parser.set_defaults( \
             outfile = "pietree", \
             #outformat = "pdf", \    # see suffix stuff instead
@@ -248,7 +510,10 @@ def AddParserArgs(parser, nstates, format_choices):
             width = 800.0, \
             xmargin = 10.0, \
             # ymargin = 10.0, \
-            scalebar = "no" \
+            scalebar = "no", \
+            batch = "no", \
+            lod = 0.0, \
+            tilesize = 256 \
             # fine to leave background color as None
             )
     # see also SetDefaults()
@@ -0,0 +1,504 @@
+#! /usr/bin/env python
+
+#--------------------------------------------------
+# Copyright 2008 Emma Goldberg
+#
+# This file is part of PieTree.
+#
+# PieTree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PieTree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PieTree.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------
+
+######################################################
+# Module:  PieLayout.py
+######################################################
+
+'''
+Compute where every node of a tree goes, both in tree coordinates and on
+the canvas, so that the drawing code only has to look the positions up.
+
+If numpy is available, each step works on a whole level of the tree at
+once (all the nodes that are the same number of branches from the root).
+Otherwise, or for small or very deep trees, it loops over the nodes.  The
+two give the same numbers.
+
+A layout depends only on the shape and branch lengths of the tree and on a
+few of the options, so a LayoutCache keeps the layouts already computed
+for pictures that differ only in other ways, such as colors or fonts.  One
+LayoutCache is shared by everything drawn in the same process, and a
+LayoutCache can also keep its layouts on disk.
+'''
+
+import os
+import sys
+import copy
+import struct
+import hashlib
+import weakref
+import tempfile
+from math import cos, sin, pi
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# numpy is used only for trees with at least this many nodes, and at least
+# this many nodes per level on average
+NUMPY_MIN_NODES = 2000
+NUMPY_MIN_WIDTH = 16
+
+# how many layouts a LayoutCache keeps in memory
+CACHE_LAYOUTS = 8
+
+_MAGIC = "PIELAYT\x01"
+
+# magic, byte order, nodes, polar, xmax, xscale, which coordinates follow
+_HEADER = struct.Struct("<8s c i ? d d i")
+
+# the positions; everything else about a layout comes from the tree
+_COORDS = ('x', 'y', 'r', 't', 'cx', 'cy', 'bx', 'by')
+
+
+class Layout(object):
+    '''
+        The positions of the nodes of a tree.  Everything is kept in lists
+        indexed by each node's place in the preorder traversal, so the root
+        is 0 and each node comes before its daughters:
+          nodes: the nodes themselves
+          parent: index of each node's parent (-1 for the root)
+          size: number of nodes in the subtree starting at each node
+          depth: distance of each node from the root
+          x, y: tree coordinates (Cartesian)
+          r, t: tree coordinates (polar; radial trees only)
+          cx, cy: canvas coordinates
+          bx, by: for radial trees, the canvas coordinates of the point
+                  where each branch meets the arc through its parent
+          xmax: the width of the tree, in tree units
+          xscale: canvas units per tree unit
+    '''
+
+    def __init__(self, root):
+
+        # the structure of the tree comes from its TreeStats
+        stats = root.Stats()
+        self.SetTree(root, stats)
+        self.parent = stats.parent
+        self.length = stats.length
+        self.size = stats.size
+        self.depth = stats.depth
+
+        n = len(self.nodes)
+        self.polar = False
+        self.x = self.y = self.r = self.t = None
+        self.cx = self.cy = self.bx = self.by = None
+        self.xmax = self.xscale = None
+
+        # work out the levels of the tree, and give up on numpy if there
+        # are too many of them
+        self.usenumpy = numpy != None and n >= NUMPY_MIN_NODES
+        if self.usenumpy:
+            self.parent = numpy.asarray(self.parent, dtype=int)
+            self.length = numpy.asarray(self.length, dtype=float)
+            depth = _Depths(self.parent)
+            if (depth.max() + 1) * NUMPY_MIN_WIDTH > n:
+                self.usenumpy = False
+                self.parent = stats.parent
+                self.length = stats.length
+            else:
+                self._MakeLevels(depth)
+
+    def _MakeLevels(self, depth):
+        '''
+        Group the nodes by depth, deepest first.  For each level, keep
+          kids: the nodes at that depth
+          starts: where each run of sisters begins within kids
+          ups: the parent of each run
+          ids: which run each of kids belongs to
+          counts: how many sisters are in each run
+        Within a level, nodes stay in preorder, so sisters are adjacent.
+        '''
+
+        order = numpy.argsort(depth, kind='mergesort')
+        bounds = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(depth))))
+        self._levels = []
+        for k in xrange(1, len(bounds) - 1):
+            kids = order[bounds[k]:bounds[k+1]]
+            par = self.parent[kids]
+            newrun = numpy.zeros(len(kids), dtype=int)
+            newrun[1:] = par[1:] != par[:-1]
+            starts = numpy.flatnonzero(newrun)
+            starts = numpy.concatenate(([0], starts))
+            ids = numpy.cumsum(newrun)
+            self._levels.append((kids, starts, par[starts], ids, \
+                    numpy.bincount(ids)))
+        self._levels.reverse()
+
+    def SetTree(self, root, stats):
+        '''Use the nodes of the tree starting at root.'''
+
+        self.root = root
+        self.nodes = stats.nodes
+
+    def Daughters(self, i):
+        '''Return the indices of node i's daughters, left to right.'''
+
+        size = self.size
+        daughters = []
+        j = i + 1
+        while j < i + size[i]:
+            daughters.append(j)
+            j += size[j]
+        return daughters
+
+    def RootDistances(self):
+        '''
+        Return the distance of each node from the root, counting the
+        length of the root's own branch.
+        '''
+
+        if self.usenumpy:
+            return numpy.asarray(self.depth) + self.length[0]
+        root = self.length[0]
+        return [d + root for d in self.depth]
+
+    def Spread(self, scale=1, divisor=1, shift=0):
+        '''
+        Return a value for every node.  The kth tip from the left (counting
+        from 0) gets (scale * k / divisor + shift), and each other node gets
+        the mean value of its daughters.
+        '''
+
+        if self.usenumpy:
+            values = numpy.zeros(len(self.size))
+            tips = numpy.asarray(self.size) == 1
+            k = numpy.arange(numpy.count_nonzero(tips))
+            values[tips] = scale * k / divisor + shift
+            for (kids, starts, ups, ids, counts) in self._levels:
+                values[ups] = numpy.bincount(ids, weights=values[kids]) / counts
+        else:
+            size = self.size
+            n = len(size)
+            values = [0.0] * n
+            k = 0
+            for i in xrange(n):
+                if size[i] == 1:
+                    values[i] = scale * k / divisor + shift
+                    k += 1
+            for i in xrange(n-1, -1, -1):
+                if size[i] > 1:
+                    daughters = self.Daughters(i)
+                    sum_v = 0.0
+                    for j in daughters:
+                        sum_v += values[j]
+                    values[i] = sum_v / len(daughters)
+        return values
+
+    def Rect(self):
+        '''
+        Lay out a rectangular tree: x is the distance from the root, and y
+        puts the tips one unit apart.  Return the largest x.
+        '''
+
+        self.x = self.RootDistances()
+        self.y = self.Spread(shift=0.5)
+        return _Max(self.x)
+
+    def Radial(self, ntips):
+        '''
+        Lay out a radial tree: r is the distance from the root, and the
+        tips are evenly spaced in theta.  Return the largest r.
+        '''
+
+        self.polar = True
+        self.r = r = self.RootDistances()
+        self.t = t = self.Spread(2 * pi, ntips)
+        if self.usenumpy:
+            self.x = r * numpy.cos(t)
+            self.y = r * numpy.sin(t)
+        else:
+            self.x = [ri * cos(ti) for (ri, ti) in zip(r, t)]
+            self.y = [ri * sin(ti) for (ri, ti) in zip(r, t)]
+        return _Max(r)
+
+    def Canvas(self, xscale, xshift, yscale, yshift):
+        '''
+        Compute the canvas coordinates, as (x * xscale + xshift) and
+        (y * yscale + yshift).  After this, all the coordinates are plain
+        lists.
+        '''
+
+        if self.usenumpy:
+            self.cx = self.x * xscale + xshift
+            self.cy = self.y * yscale + yshift
+            if self.polar:
+                rp = self.r[self.parent]
+                self.bx = rp * numpy.cos(self.t) * xscale + xshift
+                self.by = rp * numpy.sin(self.t) * yscale + yshift
+            for name in ('x', 'y', 'r', 't', 'cx', 'cy', 'bx', 'by'):
+                values = getattr(self, name)
+                if values is not None:
+                    setattr(self, name, values.tolist())
+        else:
+            self.cx = [x * xscale + xshift for x in self.x]
+            self.cy = [y * yscale + yshift for y in self.y]
+            if self.polar:
+                r = self.r
+                self.bx = [r[p] * cos(t) * xscale + xshift \
+                        for (p, t) in zip(self.parent, self.t)]
+                self.by = [r[p] * sin(t) * yscale + yshift \
+                        for (p, t) in zip(self.parent, self.t)]
+
+    def Hash(self):
+        '''
+        Return a digest of the shape and branch lengths of the tree, which
+        are all of the tree that the positions depend on.
+        '''
+
+        digest = hashlib.sha1()
+        if isinstance(self.parent, list):
+            digest.update(array('i', self.parent).tostring())
+            digest.update(array('d', self.length).tostring())
+        else:
+            digest.update(self.parent.astype(numpy.intc).tostring())
+            digest.update(self.length.astype(float).tostring())
+        return digest.hexdigest()
+
+    def Detach(self):
+        '''
+        Return a copy of the layout without the tree's nodes, so that
+        keeping the copy doesn't keep the tree.
+        '''
+
+        other = copy.copy(self)
+        other.root = other.nodes = None
+        return other
+
+    def Attach(self, root):
+        '''
+        Return a copy of a detached layout for the tree starting at root,
+        which should have the shape that the layout was made for.
+        '''
+
+        layout = copy.copy(self)
+        layout.SetTree(root, root.Stats())
+        return layout
+
+    def Bare(self):
+        '''Return a detached copy of the layout, with no positions.'''
+
+        bare = self.Detach()
+        bare.polar = False
+        bare.xmax = bare.xscale = None
+        for name in _COORDS:
+            setattr(bare, name, None)
+        return bare
+
+    def UsePositions(self, other):
+        '''Take the positions of another layout of a tree of the same shape.'''
+
+        self.polar = other.polar
+        self.xmax = other.xmax
+        self.xscale = other.xscale
+        for name in _COORDS:
+            setattr(self, name, getattr(other, name))
+
+    def Write(self, outfile):
+        '''Write the positions to an open file, after Canvas.'''
+
+        names = [name for name in _COORDS if getattr(self, name) is not None]
+        which = sum([1 << _COORDS.index(name) for name in names])
+        outfile.write(_HEADER.pack(_MAGIC, sys.byteorder[0], \
+                len(self.size), self.polar, self.xmax, self.xscale, which))
+        for name in names:
+            outfile.write(array('d', getattr(self, name)).tostring())
+
+    def Read(self, infile):
+        '''
+        Read positions written by Write for a tree of the same shape.
+        Return False, leaving the layout alone, if they can't be read.
+        '''
+
+        header = infile.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return False
+        (magic, order, n, polar, xmax, xscale, which) = \
+                _HEADER.unpack(header)
+        if magic != _MAGIC or order != sys.byteorder[0] or \
+                n != len(self.size):
+            return False
+
+        coords = {}
+        for (k, name) in enumerate(_COORDS):
+            if which & (1 << k):
+                values = array('d')
+                try:
+                    values.fromfile(infile, n)
+                except EOFError:
+                    return False
+                coords[name] = values.tolist()
+
+        self.polar = polar
+        self.xmax = xmax
+        self.xscale = xscale
+        for name in _COORDS:
+            setattr(self, name, coords.get(name))
+        return True
+
+
+class LayoutCache(object):
+    '''
+        Layouts that have already been computed.  Each is found by the
+        digest of its tree (see Layout.Hash) and a key, made by the caller,
+        of everything else that the positions depend on.
+          trees: (digest, bare layout) for each tree seen, by the tree's
+                TreeStats, so that the same tree isn't taken apart again
+                just to find its digest.  An entry goes away with the
+                TreeStats, when the tree is dropped or ForgetOrder is
+                called after it changes.
+          layouts: the layouts themselves, detached from their trees (see
+                Layout.Detach), by (digest, key)
+          directory: if not None, layouts are also saved in this
+                directory, and looked for there
+        Nothing in the cache keeps a tree in memory.
+    '''
+
+    def __init__(self, directory=None, size=CACHE_LAYOUTS):
+        self.directory = directory
+        self.size = size
+        self.trees = weakref.WeakKeyDictionary()
+        self.layouts = {}
+        self.order = []         # keys, least recently used first
+
+    def Find(self, root, key, place):
+        '''
+        Return the layout of the tree starting at root, for this key.  If
+        there isn't one already, place(layout) is called to fill in the
+        positions of a new one.
+        '''
+
+        (digest, bare) = self.Tree(root)
+        full = (digest, key)
+        layout = bare.Attach(root)
+
+        found = self.layouts.get(full)
+        if found != None:
+            self.order.remove(full)
+            self.order.append(full)
+            layout.UsePositions(found)
+            return layout
+
+        if not self.Load(layout, full):
+            place(layout)
+            self.Save(layout, full)
+        self.layouts[full] = layout.Detach()
+        self.order.append(full)
+        while len(self.order) > self.size:
+            del self.layouts[self.order.pop(0)]
+        return layout
+
+    def Tree(self, root):
+        '''Return the digest of the tree, and a bare layout of it.'''
+
+        stats = root.Stats()
+        entry = self.trees.get(stats)
+        if entry == None:
+            layout = Layout(root)
+            entry = (layout.Hash(), layout.Bare())
+            self.trees[stats] = entry
+        return entry
+
+    def Filename(self, (digest, key)):
+        '''Return the name of the file for a layout, in the directory.'''
+
+        name = hashlib.sha1(digest + repr(key)).hexdigest()
+        return os.path.join(self.directory, name + ".layout")
+
+    def Load(self, layout, full):
+        '''Read the positions saved for full, if there are any.'''
+
+        if self.directory == None:
+            return False
+        try:
+            infile = open(self.Filename(full), "rb")
+        except IOError:
+            return False
+        try:
+            return layout.Read(infile)
+        finally:
+            infile.close()
+
+    def Save(self, layout, full):
+        '''Save the layout for full.  Failure to save it is not an error.'''
+
+        if self.directory == None:
+            return
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            (fd, tempname) = tempfile.mkstemp(dir=self.directory)
+        except (IOError, OSError):
+            return
+
+        try:
+            outfile = os.fdopen(fd, "wb")
+            try:
+                layout.Write(outfile)
+            finally:
+                outfile.close()
+            os.rename(tempname, self.Filename(full))
+        except (IOError, OSError):
+            try:
+                os.remove(tempname)
+            except OSError:
+                pass
+
+
+# the cache used by default
+_cache = LayoutCache()
+
+
+def Find(root, key, place, cache=None):
+    '''As for LayoutCache.Find, using the default cache unless given one.'''
+
+    if cache == None:
+        cache = _cache
+    return cache.Find(root, key, place)
+
+
+def _Max(values):
+    '''The largest of values, which may be a list or a numpy array.'''
+
+    if isinstance(values, list):
+        return max(values)
+    return values.max()
+
+
+def _Depths(parent):
+    '''
+    Return the number of branches between each node and the root.  This
+    uses pointer jumping: each pass adds the distance to the current
+    ancestor and then jumps to that ancestor's ancestor, so the number of
+    passes grows only with the log of the depth of the tree.
+    '''
+
+    depth = (parent >= 0).astype(int)
+    up = parent.copy()
+    live = numpy.flatnonzero(up >= 0)
+    while len(live):
+        anc = up[live]
+        depth[live] += depth[anc]
+        up[live] = up[anc]
+        live = live[up[live] >= 0]
+    return depth
@@ -0,0 +1,181 @@
+#! /usr/bin/env python
+
+#--------------------------------------------------
+# Copyright 2008 Emma Goldberg
+#
+# This file is part of PieTree.
+#
+# PieTree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PieTree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PieTree.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------
+
+
+######################################################
+# Module:  PieProfile.py
+######################################################
+
+'''
+Time each phase of reading and drawing a tree, for the option "profile".
+
+The code being timed marks its phases with
+    with PieProfile.Phase("name") as phase:
+        ...
+        phase.Count("things drawn", n)
+and counts things for the whole run with PieProfile.Count("name", n).
+These do nothing unless a profile has been started, so they can stay in
+place all the time.
+
+For each phase, the profile records the wall clock and CPU time it took,
+and the peak memory use of the process (as reported by getrusage) at its
+end and how much that grew during the phase.  The whole profile is
+written as JSON.
+'''
+
+import os
+import sys
+import time
+import json
+import resource
+
+# the profile being recorded, if any
+_profile = None
+
+
+class Profile(object):
+    '''
+        The record of one run.
+          phases: a dictionary for each phase, in the order they ended
+          counts: the totals given to Count
+          job: the job whose phases are being recorded now, if any
+    '''
+
+    def __init__(self):
+        self.phases = []
+        self.counts = {}
+        self.job = None
+        self.start = time.time()
+
+    def Record(self, name, wall, cpu, rss0, rss1, counts):
+        phase = {"phase": name, "seconds": round(wall, 6), \
+                "cpu_seconds": round(cpu, 6), "peak_kb": rss1, \
+                "peak_growth_kb": rss1 - rss0, "pid": os.getpid()}
+        if self.job != None:
+            phase["job"] = self.job
+        phase["counts"] = counts    # may be added to after the phase ends
+        self.phases.append(phase)
+
+    def Add(self, other):
+        '''Add the phases and counts of a profile recorded elsewhere.'''
+
+        self.phases.extend(other.phases)
+        for (name, n) in other.counts.iteritems():
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def Write(self, filename):
+        '''Write the profile as JSON to filename, or to stdout for "-".'''
+
+        for phase in self.phases:
+            if not phase["counts"]:
+                del phase["counts"]
+        data = {"seconds": round(time.time() - self.start, 6), \
+                "peak_kb": _PeakKB(), "phases": self.phases, \
+                "counts": self.counts}
+        if filename == "-":
+            json.dump(data, sys.stdout, indent=2, sort_keys=True)
+            sys.stdout.write("\n")
+            return
+        outfile = open(filename, "w")
+        try:
+            json.dump(data, outfile, indent=2, sort_keys=True)
+            outfile.write("\n")
+        finally:
+            outfile.close()
+
+
+class _Phase(object):
+    '''Times the code in a with statement, as one phase of the profile.'''
+
+    def __init__(self, name):
+        self.name = name
+        self.counts = {}
+
+    def Count(self, name, n=1):
+        '''Add n to the count called name, for this phase.'''
+
+        if _profile != None:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def __enter__(self):
+        if _profile != None:
+            self.rss = _PeakKB()
+            self.cpu = sum(os.times()[:2])
+            self.wall = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        if _profile != None:
+            _profile.Record(self.name, time.time() - self.wall, \
+                    sum(os.times()[:2]) - self.cpu, self.rss, _PeakKB(), \
+                    self.counts)
+        return False
+
+
+def Start():
+    '''Start recording a new profile, and return it.'''
+
+    global _profile
+    _profile = Profile()
+    return _profile
+
+def Stop():
+    '''Stop recording, and return the profile (or None).'''
+
+    global _profile
+    profile = _profile
+    _profile = None
+    return profile
+
+def Active():
+    return _profile != None
+
+def Phase(name):
+    '''A context manager that records the code it runs as a phase.'''
+
+    return _Phase(name)
+
+def Count(name, n=1):
+    '''Add n to the count called name, for the whole run.'''
+
+    if _profile != None:
+        _profile.counts[name] = _profile.counts.get(name, 0) + n
+
+def Add(other):
+    '''Add a profile recorded elsewhere (by a worker process).'''
+
+    if _profile != None and other != None:
+        _profile.Add(other)
+
+def SetJob(job):
+    '''Label the phases that follow as belonging to this job.'''
+
+    if _profile != None:
+        _profile.job = job
+
+
+def _PeakKB():
+    '''The most memory this process has used so far, in kilobytes.'''
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak //= 1024       # bytes there, kilobytes elsewhere
+    return peak
@@ -33,12 +33,36 @@ Also contains CountTips()
 '''
 
 import sys
+import os
+import gc
+import mmap
+import multiprocessing
+from array import array
+from itertools import izip
+
 import Newick
-from PieError import PieTreeError
+import PieCache
+import PieProfile
+from TreeArray import TreeArray, NodeViews
+from PieError import PieTreeError, Message, KeepMessages
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # TODO: will want each node to have a *vector* for its state(s); need to check the lengths are consistent and return the number of states
 
-def ReadFromFileTTN(filename):
+# reading a big state table goes faster with a bigger buffer
+_BUFSIZE = 1 << 20
+
+# state tables at least this big are memory-mapped and parsed in parallel
+MAPPED_MIN_BYTES = 1 << 24
+
+# at most this many examples of each kind of problem are shown
+SHOW_PROBLEMS = 5
+
+def ReadFromFileTTN(filename, compact=False, cache=False):
     '''
     Read in one of my .ttn files, with relaxed assumptions:
         tree string is on a single line
@@ -46,120 +70,515 @@ def ReadFromFileTTN(filename):
             tip state is an integer [0 ... nstates]
             node state has nstates numbers
     The comment character # is respected, and blank lines are skipped.
+    If compact, the tree is stored in a TreeArray, and the root returned is
+    a view into it.
+    The file is read once, from start to finish.  If cache, a binary
+    snapshot of the result is used instead when there is a good one, and
+    made when there isn't (see PieCache); the notes and warnings about the
+    file are given either way.
+    A filename of "-" reads standard input, which is never cached.
     '''
 
-    # First, form a tree from the Newick string.
-    root = Newick.ReadFromFile(filename)
+    if filename == "-":
+        return _ReadTTN(sys.stdin, compact, "standard input")
 
-    if root == None:
-        nstates = 0
+    if cache:
+        with PieProfile.Phase("load snapshot"):
+            snapshot = PieCache.Load(filename)
+            if snapshot != None:
+                (tree, nstates, messages) = snapshot
+                for text in messages:
+                    Message(text)
+                if compact:
+                    return (tree.Root(), nstates)
+                return (tree.ToNodes(), nstates)
 
-    # Then, deal with the state information if a tree was made.
-    else:
-        state_dict = MakeStateDict(filename)
-        nstates = max(map(len, state_dict.values()))
-        PutStates(root, state_dict, nstates)
+    try:
+        infile = open(filename, "r", _BUFSIZE)
+    except IOError:
+        return (None, 0)
+
+    try:
+        with KeepMessages() as messages:
+            (root, nstates) = _ReadTTN(infile, compact, 'file "' + \
+                    filename + '"', filename)
+    finally:
+        infile.close()
+
+    if cache and root != None:
+        with PieProfile.Phase("save snapshot"):
+            if compact:
+                tree = root.tree
+            else:
+                tree = TreeArray.FromNodes(root)
+            PieCache.Save(filename, tree, nstates, messages)
 
     return (root, nstates)
 
 
-def MakeStateDict(filename):
+def _ReadTTN(infile, compact, where, filename=None):
+    '''
+    Read the tree and states from an open file, as for ReadFromFileTTN.
+    where describes the file, for error messages.  With the filename, a big
+    state table is memory-mapped (see ReadStatesMapped).
+    '''
 
-    # already did error-checking in Newick.ReadFromFile()
-    infile = open(filename, "r")
-    while 1:
-        line = infile.next().strip()
-        if line and line[0]!= "#" and line[0]!="[":
-            break
-            # now at the tree string
+    # First, form a tree from the Newick string.
+    with PieProfile.Phase("parse tree"):
+        line = Newick.FindTreeLine(infile)
+        if line == None:
+            Message("ERROR: end of file reached before finding a " + \
+                    "possible tree description.")
+            return (None, 0)
+        try:
+            if compact:
+                root = Newick.ReadCompact(line).Root()
+            else:
+                root = Newick.Read(line)
+        except Newick.NewickError, error:
+            raise PieTreeError("Bad Newick string in " + where + ": " + \
+                    error.reason)
+
+    # Then, deal with the state information, which follows the tree.  Every
+    # problem with it is reported at once, at the end.
+    problems = StateProblems()
+    with PieProfile.Phase("read states"):
+        state_dict = None
+        if filename != None:
+            offset = infile.tell()
+            size = os.fstat(infile.fileno()).st_size
+            if size - offset >= MAPPED_MIN_BYTES and \
+                    multiprocessing.cpu_count() > 1:
+                state_dict = ReadStatesMapped(filename, offset, \
+                        problems=problems)
+        if state_dict == None:
+            state_dict = ReadStates(infile, problems)
+
+    if not state_dict:
+        problems.Raise()
+        raise PieTreeError("No character states found in " + where)
+
+    with PieProfile.Phase("put states"):
+        nstates = max(map(len, state_dict.values()))
+        PutStates(root, state_dict, nstates, problems)
+    return (root, nstates)
+
+
+class TreeCache(object):
+    '''
+        The trees read most recently, so that asking for another picture of
+        the same tree doesn't read the tree file again.  A tree is read
+        again if its file has changed.
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self.trees = {}
+        self.order = []     # keys, least recently used first
+
+    def Read(self, treefile, compact, cache):
+        '''As for ReadFromFileTTN.'''
 
-    state_dict = {}
-    while 1:
         try:
-            line = infile.next().strip()
-            line = line.partition("#")[0].strip()
-            if line and line[0]!= "#" and line[0]!="[":
+            info = os.stat(treefile)
+        except OSError:
+            return ReadFromFileTTN(treefile, compact, cache)
+        key = (os.path.abspath(treefile), info.st_size, info.st_mtime, \
+                compact)
+
+        if key in self.trees:
+            self.order.remove(key)
+            self.order.append(key)
+            return self.trees[key]
+
+        value = ReadFromFileTTN(treefile, compact, cache)
+        if value[0] and self.size > 0:
+            self.trees[key] = value
+            self.order.append(key)
+            while len(self.order) > self.size:
+                del self.trees[self.order.pop(0)]
+        return value
+
+
+def ReadStates(lines, problems=None):
+    '''
+    Make a dictionary of the states given in these lines (e.g., the rest of
+    an open file), mapping each label to a list of its state values.
+    Lines that can't be read are added to problems, if given; otherwise
+    they are all reported in one PieTreeError.
+    '''
+
+    if problems == None:
+        check = problems = StateProblems()
+    else:
+        check = None
+
+    state_dict = {}
+    repeated = []
+    for line in lines:
+        line = line.partition("#")[0].strip()
+        if line and line[0]!="[":
+            try:
                 (name, state) = line.split(None, 1)
-                if name in state_dict:
-                    print "WARNING: label %s is used more than once" \
-                            % (name)
-                state_dict[name] = map(float, state.split())
-                # lengths of state lists will be checked later, in PutStates
-
-        except ValueError:
-            infile.close()
-            raise PieTreeError("Problem reading character states.  " + \
-                    "Something is wrong with:\n   " + line + \
-                    "\nProper format is, e.g.:\n   tip1   tipstate\n" + \
-                    "   node1   state0   state1")
+                values = map(float, state.split())
+            except ValueError:
+                problems.Add(BAD_LINE, line)
+                continue
+            if name in state_dict:
+                repeated.append(name)
+            state_dict[name] = values
+            # lengths of state lists will be checked later, in PutStates
+
+    _WarnRepeated(repeated)
+    if check != None:
+        check.Raise()
+    return state_dict
+
+
+def _WarnRepeated(names):
+    if names:
+        Message("WARNING: %d labels are used more than once " % len(names) + \
+                "(the last state given is used): " + _Examples(sorted(set( \
+                names)), len(set(names))))
+
+
+def ReadStatesMapped(filename, offset, nprocs=None, problems=None):
+    '''
+    Like ReadStates(), for the part of the file from offset to the end.
+    That part is memory-mapped and cut into chunks at line breaks, and the
+    chunks are parsed by a pool of nprocs processes (default: one per CPU).
+    The results are merged in file order, so a label that is used more than
+    once is still noticed, and the last of its lines wins.
+    Lines that can't be read are treated as in ReadStates().
+    '''
+
+    if problems == None:
+        check = problems = StateProblems()
+    else:
+        check = None
+
+    if nprocs == None:
+        nprocs = multiprocessing.cpu_count()
 
-        except StopIteration:
+    # chunk boundaries, each just after a newline
+    infile = open(filename, "rb")
+    try:
+        mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        infile.close()
+    size = len(mapped)
+    nchunks = max(1, 4 * nprocs)
+    bounds = [offset]
+    for k in range(1, nchunks):
+        start = max(offset + (size - offset) * k // nchunks, bounds[-1])
+        newline = mapped.find("\n", start)
+        if newline < 0:
             break
+        if newline + 1 > bounds[-1]:
+            bounds.append(newline + 1)
+    bounds.append(size)
+    chunks = zip(bounds[:-1], bounds[1:])
+
+    if nprocs > 1 and len(chunks) > 1:
+        mapped.close()
+        pool = multiprocessing.Pool(nprocs, _MapFile, (filename,))
+        try:
+            results = pool.map(_ParseChunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        global _mapped
+        _mapped = mapped
+        try:
+            results = map(_ParseChunk, chunks)
+        finally:
+            _mapped = None
+            mapped.close()
+
+    # (the many small lists would set off the garbage collector repeatedly)
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        state_dict = {}
+        repeated = []
+        for (names, lengths, values, nbad, bad) in results:
+            if nbad:
+                problems.Add(BAD_LINE, bad, nbad)
+            if not names:
+                continue
+            names = names.split("\n")
+            lengths = array('i', lengths)
+            values = array('d', values).tolist()
+            pos = 0
+            for i in xrange(len(names)):
+                name = names[i]
+                if name in state_dict:
+                    repeated.append(name)
+                state_dict[name] = values[pos:pos + lengths[i]]
+                pos += lengths[i]
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    _WarnRepeated(repeated)
+    if check != None:
+        check.Raise()
+    return state_dict
+
 
+# the memory-mapped file, in each worker process
+_mapped = None
+
+def _MapFile(filename):
+    global _mapped
+    infile = open(filename, "rb")
+    _mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
     infile.close()
-    return state_dict
 
 
-def PutStates(node, state_dict, nstates):
+def _ParseChunk((start, end)):
+    '''
+    Parse the state lines in bytes start:end of the mapped file.  Returns the
+    labels joined by newlines, and the numbers of values and the values as
+    packed arrays (cheap to send back from a worker process); then the
+    number of lines that can't be read, and the first few of them.
+    '''
 
-    try:
-        state = state_dict[node.label]
+    names = []
+    lengths = array('i')
+    values = array('d')
+    nbad = 0
+    bad = []
+    for line in _mapped[start:end].splitlines():
+        line = line.partition("#")[0].strip()
+        if line and line[0]!="[":
+            fields = line.split()
+            try:
+                if len(fields) < 2:
+                    raise ValueError
+                row = map(float, fields[1:])
+            except ValueError:
+                nbad += 1
+                if len(bad) < SHOW_PROBLEMS:
+                    bad.append(line)
+                continue
+            names.append(fields[0])
+            lengths.append(len(row))
+            values.extend(row)
+
+    return ("\n".join(names), lengths.tostring(), values.tostring(), \
+            nbad, bad)
+
+
+def PutStates(root, state_dict, nstates, problems=None):
+    '''
+    Give each tip and node in the tree its state from state_dict.  The
+    states are all checked, the numbers in bulk, and every problem is
+    reported in one PieTreeError (along with any already in problems).
+    Tips and labeled nodes with no state are noted.
+    '''
 
-        # for a tip
+    if problems == None:
+        problems = StateProblems()
+
+    # sort the states into tips and nodes, checking their lengths
+    tips = []
+    tipvalues = []
+    nodes = []
+    nodevalues = []
+    missing = []
+    nmissing = [0, 0]       # tips, nodes
+    for node in root.Preorder():
+        state = state_dict.get(node.label)
         if node.daughters == None:
-            if len(state) != 1:
-                raise PieTreeError("specify each tip state as a single value, e.g.,\n   tip1  1")
-            state = int(state[0])
-            if state not in range(nstates):
-                raise PieTreeError('invalid state "' + str(state) + '" for tip "' \
-                                    + str(node.label) + '"')
+            if state == None:
+                if len(missing) < SHOW_PROBLEMS:
+                    missing.append(node.label)
+                nmissing[0] += 1
+            elif len(state) != 1:
+                problems.Add(TIP_LENGTH, "%s (%d values)" % (node.label, \
+                        len(state)))
+            else:
+                tips.append(node)
+                tipvalues.append(state[0])
+        else:
+            if state == None:
+                # an unlabeled node can't be in the state table
+                if node.label != None:
+                    if len(missing) < SHOW_PROBLEMS:
+                        missing.append(node.label)
+                    nmissing[1] += 1
+            elif len(state) != nstates:
+                problems.Add(NODE_LENGTH, "%s (%d values)" % (node.label, \
+                        len(state)))
+            else:
+                node.state = state      # (no use if there are problems)
+                nodes.append(node)
+                nodevalues.append(state)
+
+    # then check the numbers all together
+    tipstates = _CheckTipStates(tips, tipvalues, nstates, problems)
+    _CheckNodeSums(nodes, nodevalues, problems)
+    problems.Raise(nstates)
+
+    for (node, state) in izip(tips, tipstates):
+        node.state = state
+
+    if nmissing[0] or nmissing[1]:
+        Message("NOTE: no state given for %d tips and %d nodes" % \
+                tuple(nmissing) + _Examples(missing, sum(nmissing), ": "))
+
+
+def _CheckTipStates(tips, values, nstates, problems):
+    '''
+    Return the tip states as whole numbers, adding any that are out of
+    range to problems.  (Like int(), this rounds towards 0, so a state
+    is good if it is greater than -1 and less than nstates.)
+    '''
 
-            node.state = state
+    if numpy != None and len(values) > 0:
+        values = numpy.asarray(values)
+        with numpy.errstate(invalid="ignore"):      # nan is just bad
+            bad = numpy.flatnonzero(~((values > -1) & (values < nstates)))
+            states = values.astype(int)
+        states[bad] = 0
+        states = states.tolist()
+        values = values.tolist()
+    else:
+        bad = [k for (k, v) in enumerate(values) if not (-1 < v < nstates)]
+        states = [int(v) if -1 < v < nstates else 0 for v in values]
+    if len(bad) > 0:
+        problems.Add(TIP_RANGE, ["%s (%g)" % (tips[k].label, values[k]) \
+                for k in bad[:SHOW_PROBLEMS]], len(bad))
+    return states
+
+
+def _CheckNodeSums(nodes, values, problems):
+    '''Add the nodes whose state values don't sum to 1 to problems.'''
+
+    # (numpy is slow to take in a list of lists, so the sums are not
+    # done with it)
+    sums = map(sum, values)
+    if numpy != None and len(sums) > 0:
+        with numpy.errstate(invalid="ignore"):
+            bad = numpy.flatnonzero(~(abs(numpy.asarray(sums) - 1) <= 0.01))
+    else:
+        bad = [k for (k, s) in enumerate(sums) if not (abs(s - 1) <= 0.01)]
+    if len(bad) > 0:
+        problems.Add(NODE_SUM, ["%s (%g)" % (nodes[k].label, sums[k]) \
+                for k in bad[:SHOW_PROBLEMS]], len(bad))
 
-        # for a node
-        else:
-            if len(state) != nstates:
-                raise PieTreeError("incorrect number of state values given for node " + node.label + " (" + str(nstates) + " expected)")
-            if abs(sum(state) - 1) > 0.01:
-                raise PieTreeError("sum of states for each node should sum to 1")
-            node.state = state
 
-    except KeyError:
-        # raise PieTreeError("can't find a state for " + node.label)
-        pass
+# kinds of problems with the states
+BAD_LINE = "lines can't be read"
+TIP_LENGTH = "tips have more than one state value"
+TIP_RANGE = "tip states are not between 0 and %(last)d"
+NODE_LENGTH = "nodes don't have %(nstates)d state values"
+NODE_SUM = "nodes' state values don't sum to 1"
 
-    if node.daughters != None:
-        for d in node.daughters:
-            PutStates(d, state_dict, nstates)
 
+class StateProblems(object):
+    '''
+        Everything wrong with the character states, collected so that it
+        can all be reported at once.
+          counts: how many problems there are of each kind
+          examples: the first few of each kind
+    '''
 
-def CountTips(node):
-    '''return the number of tips'''
+    def __init__(self):
+        self.kinds = []
+        self.counts = {}
+        self.examples = {}
+
+    def Add(self, kind, examples, count=1):
+        '''Add count problems of a kind, with an example or a list of
+           them.'''
+
+        if kind not in self.counts:
+            self.kinds.append(kind)
+            self.counts[kind] = 0
+            self.examples[kind] = []
+        self.counts[kind] += count
+        if isinstance(examples, basestring):
+            examples = [examples]
+        room = SHOW_PROBLEMS - len(self.examples[kind])
+        self.examples[kind].extend(examples[:max(room, 0)])
+
+    def Raise(self, nstates=None):
+        '''Raise a PieTreeError describing all the problems, if any.'''
+
+        if not self.kinds:
+            return
+        lines = ["Problems with the character states:"]
+        for kind in self.kinds:
+            count = self.counts[kind]
+            if nstates != None:
+                kind_text = kind % {"last": nstates - 1, "nstates": nstates}
+            else:
+                kind_text = kind
+            lines.append("   %d %s: %s" % (count, kind_text, \
+                    _Examples(self.examples[kind], count)))
+        if BAD_LINE in self.counts or TIP_LENGTH in self.counts:
+            lines.append("Proper format is, e.g.:\n   tip1   tipstate\n" + \
+                    "   node1   state0   state1")
+        raise PieTreeError("\n".join(lines))
 
-    if node.daughters != None:
 
-        if len(node.daughters) != 2:
-            print "NOTE: tree is not strictly bifurcating"
-            node.PrintNode()
+def _Examples(examples, count, before=""):
+    '''List the first few examples, saying how many more there are.'''
 
-        count_sum = 0.0
-        for d in node.daughters:
-            count_sum += CountTips(d)
-        return count_sum
+    if not examples:
+        return ""
+    shown = examples[:SHOW_PROBLEMS]
+    text = before + ", ".join([str(e) for e in shown])
+    if count > len(shown):
+        text += ", and %d more" % (count - len(shown))
+    return text
 
-    else:
-        return 1
 
-def AssignNodeTimes(node, root_time=0):
+def CountTips(root):
+    '''return the number of tips (from the tree's TreeStats)'''
+
+    stats = root.Stats()
+    nmulti = len(stats.multi)
+    if nmulti:
+        multi = ["%s (%d daughters)" % (stats.nodes[i].label, \
+                len(stats.nodes[i].daughters)) \
+                for i in stats.multi[:SHOW_PROBLEMS]]
+        Message("NOTE: tree is not strictly bifurcating at %d nodes: " \
+                % nmulti + _Examples(multi, nmulti))
+    return stats.tips[0]
+
+
+def CountStates(root):
     '''
-    Use given branch lengths to assign node times.
+    Return the number of states of a tree whose states are already in
+    place: as for a tree file, the longest list of node state values.
     '''
 
-    if node.parent == None:
-        node.time = root_time
-    else:
-        node.time = node.parent.time + node.length
+    nstates = 0
+    for node in root.Preorder():
+        if node.state != None:
+            if node.daughters == None:
+                nstates = max(nstates, 1)
+            else:
+                nstates = max(nstates, len(node.state))
+    return nstates
 
-    if node.daughters != None:
-        for d in node.daughters:
-            AssignNodeTimes(d, root_time)
+def AssignNodeTimes(root, root_time=0):
+    '''
+    Use given branch lengths to assign node times.  These are the depths
+    already found by TreeNode.Stats, so this is one quick pass.
+    '''
+
+    stats = root.Stats()
+    nodes = stats.nodes
+    if isinstance(nodes, NodeViews):
+        # straight into the TreeArray
+        times = nodes.tree.time
+        for (i, depth) in izip(nodes.indices, stats.depth):
+            times[i] = root_time + depth
+    else:
+        for (node, depth) in izip(nodes, stats.depth):
+            node.time = root_time + depth
@@ -0,0 +1,223 @@
+#! /usr/bin/env python
+
+#--------------------------------------------------
+# Copyright 2008 Emma Goldberg
+#
+# This file is part of PieTree.
+#
+# PieTree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PieTree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PieTree.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------
+
+######################################################
+# Module:  PieServer.py
+######################################################
+
+'''
+Keep PieTree running as a server, so that many pictures can be drawn
+without starting Python, reading the tree file, and loading fonts for
+each one.
+
+The server speaks HTTP, either on a localhost port or on a Unix socket.
+Ask for a picture with a GET or POST to /render, giving the usual PieTree
+options as form fields; the reply is the picture itself.  For example:
+
+  PieServer.py --port 8642 &
+  curl -d treefile=/data/tree.ttn -d shape=radial -d outformat=png \\
+          http://localhost:8642/render > tree.png
+
+An option file can be given with optfile, and a job (section) within it
+with job; otherwise the first job is drawn.  File names are relative to
+the directory the server was started in.
+
+Several worker processes take requests from the same socket, and each
+keeps the trees it has read most recently in memory.
+'''
+
+import sys
+import os
+import stat
+import socket
+import argparse
+import urlparse
+import multiprocessing
+import BaseHTTPServer
+import SocketServer
+from cStringIO import StringIO
+
+import PieInput
+import PieReadTree
+import PieTree
+from PieError import PieTreeError, SetMessageHook
+
+CONTENT_TYPES = {
+    "pdf": "application/pdf",
+    "eps": "application/postscript",
+    "svg": "image/svg+xml",
+    "png": "image/png",
+}
+
+
+def RenderFields(fields, trees=None):
+    '''
+    Draw the picture described by a list of (option, value) pairs, and
+    return (the image data, its format).
+    '''
+
+    options = dict(fields)
+    if options.get("treefile") == "-":
+        raise PieTreeError("the server can't read a tree from standard input")
+
+    if trees == None:
+        readtree = None
+    else:
+        readtree = trees.Read
+    (c, root, ntips, nstates) = PieInput.ParseOptions(options, \
+            readtree=readtree)
+
+    if c.outformat not in CONTENT_TYPES:
+        raise PieTreeError("the server can't draw " + c.outformat)
+
+    data = StringIO()
+    PieTree.DrawJob(c, root, ntips, nstates, data)
+    return (data.getvalue(), c.outformat)
+
+
+class RenderHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''Answers requests to /render.'''
+
+    def do_GET(self):
+        (path, query) = self.SplitPath()
+        if path != "/render":
+            self.Reply(404, "text/plain", "only /render is available\n")
+            return
+        self.Render(urlparse.parse_qsl(query))
+
+    def do_POST(self):
+        (path, query) = self.SplitPath()
+        if path != "/render":
+            self.Reply(404, "text/plain", "only /render is available\n")
+            return
+        length = int(self.headers.getheader("content-length") or 0)
+        body = self.rfile.read(length)
+        self.Render(urlparse.parse_qsl(query) + urlparse.parse_qsl(body))
+
+    def SplitPath(self):
+        if "?" in self.path:
+            return self.path.split("?", 1)
+        return (self.path, "")
+
+    def Render(self, fields):
+        try:
+            (data, outformat) = RenderFields(fields, self.server.trees)
+        except PieTreeError, error:
+            if error.value != None:
+                message = error.value
+            else:
+                message = "PieTree ERROR: no options given"
+            self.Reply(400, "text/plain", message + "\n")
+            return
+        self.Reply(200, CONTENT_TYPES[outformat], data)
+
+    def Reply(self, code, content_type, data):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # works for Unix sockets too, which have no client address
+        sys.stderr.write("%s [%d] %s\n" % (self.log_date_time_string(), \
+                os.getpid(), format % args))
+
+
+class UnixHTTPServer(SocketServer.UnixStreamServer):
+    '''As for BaseHTTPServer.HTTPServer, but on a Unix socket.'''
+
+    def __init__(self, path, handler):
+        # replace a socket left behind by an earlier server
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.remove(path)
+        SocketServer.UnixStreamServer.__init__(self, path, handler)
+
+
+def RunServer(argv=None):
+
+    parser = argparse.ArgumentParser(description="Draw PieTree " + \
+            "pictures on request, over HTTP on a localhost port or a " + \
+            "Unix socket.")
+    parser.add_argument("--port", type=int, default=8642, \
+            help="localhost port to listen on [default 8642]")
+    parser.add_argument("--socket", \
+            help="Unix socket to listen on, instead of a port")
+    parser.add_argument("--workers", type=int, \
+            default=multiprocessing.cpu_count(), \
+            help="number of pictures drawn at once [default: one per core]")
+    parser.add_argument("--trees", type=int, default=8, \
+            help="number of trees each worker keeps in memory [default 8]")
+    ap = parser.parse_args(argv)
+
+    if ap.workers < 1:
+        raise PieTreeError("workers should be at least 1")
+
+    try:
+        if ap.socket:
+            server = UnixHTTPServer(ap.socket, RenderHandler)
+            where = ap.socket
+        else:
+            server = BaseHTTPServer.HTTPServer(("127.0.0.1", ap.port), \
+                    RenderHandler)
+            where = "http://127.0.0.1:%d/render" % ap.port
+    except socket.error, error:
+        raise PieTreeError("can't listen on " + \
+                (ap.socket or "port %d" % ap.port) + ": " + str(error))
+    server.trees = PieReadTree.TreeCache(ap.trees)
+
+    # each worker takes its own requests from the shared socket
+    print "serving on %s with %d workers" % (where, ap.workers)
+    sys.stdout.flush()
+    workers = [multiprocessing.Process(target=_Serve, args=(server,)) \
+            for k in range(ap.workers)]
+    for p in workers:
+        p.start()
+    try:
+        for p in workers:
+            p.join()
+    except KeyboardInterrupt:
+        for p in workers:
+            p.terminate()
+    finally:
+        server.server_close()
+        if ap.socket and os.path.exists(ap.socket):
+            os.remove(ap.socket)
+
+
+def _Serve(server):
+    # warnings and notes go to the log, with the requests
+    SetMessageHook(lambda text: sys.stderr.write("[%d] %s\n" % \
+            (os.getpid(), text)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+
+    try:
+        RunServer()
+    except PieTreeError, error:
+        if error.value != None:
+            print "\n" + error.value + "\n"
+        sys.exit(1)
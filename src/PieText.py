@@ -0,0 +1,137 @@
+#! /usr/bin/env python
+
+#--------------------------------------------------
+# Copyright 2008 Emma Goldberg
+#
+# This file is part of PieTree.
+#
+# PieTree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PieTree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PieTree.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------
+
+######################################################
+# Module:  PieText.py
+######################################################
+
+'''
+Measure and draw text labels, remembering the size and the glyphs of each
+label so that it is only measured and laid out once.
+
+The remembered values depend only on the font face, the font size, and
+the text, so one TextCache is shared by everything drawn in the same
+process.
+'''
+
+import cairo
+
+# the cache is emptied when it gets this big
+CACHE_MAX = 200000
+
+# cairo's font size until it is told otherwise
+_DEFAULT_SIZE = 10.0
+
+
+class TextCache(object):
+    '''
+        The extents and glyphs of text strings, keyed on
+        (font face, font size, text).
+          extents: as returned by text_extents
+          glyphs: as returned by text_to_glyphs, for text starting at (0, 0)
+    '''
+
+    def __init__(self):
+        self.extents = {}
+        self.glyphs = {}
+
+    def Clear(self):
+        self.extents.clear()
+        self.glyphs.clear()
+
+    def Full(self):
+        return len(self.extents) + len(self.glyphs) >= CACHE_MAX
+
+
+# the cache used by default
+_cache = TextCache()
+
+
+class Text(object):
+    '''
+        Draws and measures text on one cairo context.  All font changes
+        should go through this, so that it knows which font is in use.
+    '''
+
+    def __init__(self, cr, cache=None):
+        self.cr = cr
+        if cache == None:
+            cache = _cache
+        self.cache = cache
+        self.face = None
+        self.size = _DEFAULT_SIZE
+        self.useglyphs = hasattr(cairo.ScaledFont, "text_to_glyphs")
+
+    def SelectFace(self, family, slant):
+        '''Use the font family ("serif" or "sans") and slant given.'''
+
+        self.cr.select_font_face(family, slant)
+        self.face = (family, slant)
+
+    def SelectStyle(self, serif, italic):
+        '''Use a serif or sans-serif face, italic or not ("yes"/"no").'''
+
+        if italic == "yes":
+            slant = cairo.FONT_SLANT_ITALIC
+        else:
+            slant = cairo.FONT_SLANT_NORMAL
+        if serif == "yes":
+            self.SelectFace("serif", slant)
+        else:
+            self.SelectFace("sans", slant)
+
+    def SetSize(self, size):
+        '''Use this font size.'''
+
+        if size != self.size:
+            self.cr.set_font_size(size)
+            self.size = size
+
+    def Extents(self, text):
+        '''Return text_extents for text in the current font.'''
+
+        key = (self.face, self.size, text)
+        extents = self.cache.extents.get(key)
+        if extents == None:
+            if self.cache.Full():
+                self.cache.Clear()
+            extents = tuple(self.cr.text_extents(text))
+            self.cache.extents[key] = extents
+        return extents
+
+    def ShowAt(self, x, y, text):
+        '''Draw text in the current font, starting at (x, y).'''
+
+        cr = self.cr
+        if not self.useglyphs:
+            cr.move_to(x, y)
+            cr.show_text(text)
+            return
+
+        key = (self.face, self.size, text)
+        glyphs = self.cache.glyphs.get(key)
+        if glyphs == None:
+            if self.cache.Full():
+                self.cache.Clear()
+            glyphs = cr.get_scaled_font().text_to_glyphs(0, 0, text, False)
+            glyphs = [(g[0], g[1], g[2]) for g in glyphs]
+            self.cache.glyphs[key] = glyphs
+        cr.show_glyphs([(g, gx + x, gy + y) for (g, gx, gy) in glyphs])
@@ -0,0 +1,304 @@
+#! /usr/bin/env python
+
+#--------------------------------------------------
+# Copyright 2008 Emma Goldberg
+#
+# This file is part of PieTree.
+#
+# PieTree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PieTree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PieTree.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------
+
+######################################################
+# Module:  PieTiles.py
+######################################################
+
+'''
+Draw a tree as a pyramid of PNG tiles, for trees too big to see in one
+picture.
+
+The outfile is a directory holding z/x/y.png for each tile and a small
+manifest.json describing the pyramid.  At the deepest zoom level, z =
+maxzoom, the picture is drawn at its full size (width by height pixels);
+each level up is half the size, until at z = 0 it fits in a single tile.
+Tile x counts columns from the left and tile y counts rows from the top.
+
+The tree is read and laid out only once.  Each tile draws only the pies,
+boxes, labels, and forks that reach into it, and the tiles are drawn by
+several processes at once.
+'''
+
+import os
+import math
+import json
+import collections
+import multiprocessing
+import cairo
+
+import PieClasses
+import PieDetail
+import PieText
+from PieError import PieTreeError
+
+# a fork or node that spans more than this many cells of the index is
+# checked for every tile, rather than being listed in each cell
+_BIG_CELLS = 64
+
+
+def DrawTiles(c, root, ntips, nstates):
+    '''Draw the tile pyramid for the options in c.'''
+
+    size = c.tilesize
+    if size < 1:
+        raise PieTreeError("tilesize should be at least 1")
+
+    # lay out the tree once, measuring text on a scratch surface
+    scratch = cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1)
+    cr = cairo.Context(scratch)
+    text = PieText.Text(cr)
+    text.SelectStyle(c.serif, c.italic)
+    tree = PieClasses.MakeTree(c, root, ntips, nstates, cr, text)
+    tree.CalcXY(tree.TipSize())
+    index = TileIndex(tree)
+
+    # the levels of the pyramid, and the tiles in each
+    maxzoom = int(math.ceil(math.log(max(c.width, c.height) / size, 2)))
+    maxzoom = max(maxzoom, 0)
+    tiles = []
+    for z in range(maxzoom + 1):
+        scale = 2. ** (z - maxzoom)
+        ncols = int(math.ceil(c.width * scale / size))
+        nrows = int(math.ceil(c.height * scale / size))
+        for x in range(ncols):
+            dirname = os.path.join(c.outfile, str(z), str(x))
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            for y in range(nrows):
+                tiles.append((z, x, y))
+
+    WriteManifest(os.path.join(c.outfile, "manifest.json"), [ \
+            ("format", "png"), ("tiles", "{z}/{x}/{y}.png"), \
+            ("tilesize", size), ("minzoom", 0), ("maxzoom", maxzoom), \
+            ("width", c.width), ("height", c.height), \
+            ("shape", c.shape), ("ntips", ntips)])
+
+    # draw the tiles, with a pool of processes unless this already is one
+    global _shared
+    _shared = (c, root, ntips, nstates, tree.layout, index, maxzoom)
+    if c.workers > 1:
+        workers = c.workers
+    else:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, len(tiles))
+    if workers > 1 and not multiprocessing.current_process().daemon:
+        pool = multiprocessing.Pool(workers)
+        try:
+            pool.map(_DrawTile, tiles, chunksize=16)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for tile in tiles:
+            _DrawTile(tile)
+    _shared = None
+
+
+def WriteManifest(filename, items):
+    '''Write (name, value) pairs of strings and numbers as a JSON object.'''
+
+    outfile = open(filename, "w")
+    try:
+        json.dump(collections.OrderedDict(items), outfile, indent=2, \
+                separators=(",", ": "))
+        outfile.write("\n")
+    finally:
+        outfile.close()
+
+
+# what the worker processes need, inherited from the parent process
+_shared = None
+
+def _DrawTile((z, x, y)):
+    '''Draw tile x, y of zoom level z, and save it.'''
+
+    (c, root, ntips, nstates, layout, index, maxzoom) = _shared
+    size = c.tilesize
+    scale = 2. ** (z - maxzoom)
+
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, size, size)
+    cr = cairo.Context(surface)
+    if c.backcolor != None:
+        cr.set_source_rgb(c.backcolor[0], c.backcolor[1], c.backcolor[2])
+        cr.paint()
+
+    # from tile pixels to canvas coordinates
+    cr.scale(scale, scale)
+    cr.translate(-x * size / scale, -y * size / scale)
+    window = (x * size / scale, y * size / scale, \
+            (x + 1) * size / scale, (y + 1) * size / scale)
+
+    text = PieText.Text(cr)
+    text.SelectStyle(c.serif, c.italic)
+    tree = PieClasses.MakeTree(c, root, ntips, nstates, cr, text)
+    tree.layout = layout
+
+    # only what reaches into this tile, and only what can be seen at this
+    # zoom level
+    (nodes, forks) = index.Find(window)
+    tree.detail = PieDetail.Detail(layout, c, c.lod / scale, nodes, forks)
+    tree.PlotTree()
+    if c.scalebar:
+        tree.DrawScalebar()
+
+    surface.write_to_png(os.path.join(c.outfile, str(z), str(x), \
+            str(y) + ".png"))
+
+
+class TileIndex(object):
+    '''
+        Which nodes are drawn where on the canvas, so that the nodes that
+        reach into a tile can be found without looking at every node.
+          nodebox: for each node, the canvas box (x0, y0, x1, y1) that its
+                pie or box and its own label fit in
+          forkbox: for each internal node, the box its fork fits in
+          cells: for each square of the canvas, the nodes whose boxes
+                reach into it
+          big: the nodes whose boxes reach into too many squares to list
+    '''
+
+    def __init__(self, tree):
+        c = tree.plot_vars
+        layout = tree.layout
+        (cx, cy, size) = (layout.cx, layout.cy, layout.size)
+        n = len(size)
+
+        # everything drawn at a node is within reach of it, even its label
+        # turned to any angle
+        text = tree.text
+        base = max(c.pieradius, c.boxsize) + c.rimthick + c.tipspacing
+        self.nodebox = []
+        for (i, node) in enumerate(layout.nodes):
+            reach = base
+            if node.label != None:
+                if size[i] == 1:
+                    fontsize = c.tipnamesize
+                else:
+                    fontsize = c.nodenamesize
+                text.SetSize(fontsize)
+                reach += text.Extents(node.label)[2] + fontsize
+            self.nodebox.append((cx[i] - reach, cy[i] - reach, \
+                    cx[i] + reach, cy[i] + reach))
+
+        self.forkbox = [None] * n
+        thick = c.linethick
+        for i in xrange(n):
+            if size[i] > 1:
+                if layout.polar:
+                    box = _RadialForkBox(layout, i, c)
+                else:
+                    box = _RectForkBox(layout, i)
+                self.forkbox[i] = (box[0] - thick, box[1] - thick, \
+                        box[2] + thick, box[3] + thick)
+
+        # file every node under the squares its boxes reach into
+        self.cellsize = float(c.tilesize)
+        self.cells = {}
+        self.big = []
+        for i in xrange(n):
+            box = self.nodebox[i]
+            if self.forkbox[i] != None:
+                box = _Union(box, self.forkbox[i])
+            (col0, row0, col1, row1) = self.Cells(box)
+            if (col1 - col0 + 1) * (row1 - row0 + 1) > _BIG_CELLS:
+                self.big.append(i)
+                continue
+            for col in xrange(col0, col1 + 1):
+                for row in xrange(row0, row1 + 1):
+                    self.cells.setdefault((col, row), []).append(i)
+
+    def Cells(self, (x0, y0, x1, y1)):
+        '''Return the first and last column and row of squares in a box.'''
+
+        cellsize = self.cellsize
+        return (int(math.floor(x0 / cellsize)), \
+                int(math.floor(y0 / cellsize)), \
+                int(math.floor(x1 / cellsize)), \
+                int(math.floor(y1 / cellsize)))
+
+    def Find(self, window):
+        '''
+        Return the nodes (in preorder) whose pie, box, or label reaches into
+        the window, and the set of nodes whose fork does.
+        '''
+
+        found = set(self.big)
+        (col0, row0, col1, row1) = self.Cells(window)
+        cells = self.cells
+        if len(cells) < (col1 - col0 + 1) * (row1 - row0 + 1):
+            for ((col, row), nodes) in cells.iteritems():
+                if col0 <= col <= col1 and row0 <= row <= row1:
+                    found.update(nodes)
+        else:
+            for col in xrange(col0, col1 + 1):
+                for row in xrange(row0, row1 + 1):
+                    nodes = cells.get((col, row))
+                    if nodes != None:
+                        found.update(nodes)
+
+        nodes = []
+        forks = set()
+        for i in sorted(found):
+            if _Overlap(self.nodebox[i], window):
+                nodes.append(i)
+            box = self.forkbox[i]
+            if box != None and _Overlap(box, window):
+                forks.add(i)
+        return (nodes, forks)
+
+
+def _RectForkBox(layout, i):
+    '''The box around the lines from node i to its daughters.'''
+
+    (cx, cy) = (layout.cx, layout.cy)
+    daughters = layout.Daughters(i)
+    xs = [cx[i]] + [cx[j] for j in daughters]
+    ys = [cy[i]] + [cy[j] for j in daughters]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def _RadialForkBox(layout, i, c):
+    '''The box around the lines and the arc from node i to its daughters.'''
+
+    daughters = layout.Daughters(i)
+    xs = [layout.cx[j] for j in daughters] + [layout.bx[j] for j in daughters]
+    ys = [layout.cy[j] for j in daughters] + [layout.by[j] for j in daughters]
+
+    # the arc also reaches out to any of the four compass points it passes
+    t = [layout.t[j] for j in daughters]
+    (mint, maxt) = (min(t), max(t))
+    R = layout.r[i] * layout.xscale
+    for k in range(4):
+        angle = k * math.pi / 2
+        if mint <= angle <= maxt:
+            xs.append(c.width / 2. + R * math.cos(angle))
+            ys.append(c.height / 2. + R * math.sin(angle))
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def _Union(a, b):
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), \
+            max(a[3], b[3]))
+
+
+def _Overlap(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
@@ -31,45 +31,243 @@ Produce a pretty picture of it.
 '''
 
 import sys
-import cairo
+import os
+import re
+import time
+import multiprocessing
+from cStringIO import StringIO
 
 import PieInput
-import PieClasses
-from PieError import PieTreeError
+import PieReadTree
+import PieProfile
+from PieError import PieTreeError, Message, SetMessageHook
+
+# how often, in seconds, watch looks for changed files
+WATCH_SECONDS = 1
 
 
 def RunPieTree():
 
     ### work through the user input ###
 
-    (c, root, ntips, nstates) = PieInput.ParseInput()
+    # messages go to stderr, to keep them out of a picture written to
+    # standard output
+    SetMessageHook(lambda text: sys.stderr.write(text + "\n"))
+
+    # the tree is kept, in case it is drawn again (see Watch)
+    trees = PieReadTree.TreeCache(1)
+    argv = sys.argv[1:]
+    (jobs, root, ntips, nstates) = PieInput.ParseInput(argv, trees.Read)
+
+    tostdout = [c for c in jobs if c.outfile == "-"]
+    if len(tostdout) > 1:
+        raise PieTreeError("only one job can write to standard output")
+    if tostdout and jobs[0].profile == "-":
+        raise PieTreeError("the picture and the profile can't both go " + \
+                "to standard output")
+
+    if jobs[0].dryrun == "yes":
+        DryRun(jobs)
+        return
+
+    if jobs[0].watch == "yes":
+        Watch(argv, trees, jobs, root, ntips, nstates)
+        return
+
+    DrawJobs(jobs, root, ntips, nstates)
+
+    if PieProfile.Active():
+        PieProfile.Stop().Write(jobs[0].profile)
+
+
+def DrawJobs(jobs, root, ntips, nstates, serial=False):
+    '''Draw each picture, with a pool of processes if asked.  With serial,
+       they are drawn one at a time, so that their layouts stay in this
+       process's PieLayout.LayoutCache.'''
+
+    workers = min(jobs[0].workers, len(jobs))
+    if workers > 1 and not serial:
+        global _shared
+        _shared = (jobs, root, ntips, nstates)
+        pool = multiprocessing.Pool(workers)
+        try:
+            profiles = pool.map(_DrawJobNumber, range(len(jobs)))
+        finally:
+            pool.close()
+            pool.join()
+        # the workers' profiles come back with their pictures
+        if PieProfile.Active():
+            for profile in profiles:
+                PieProfile.Add(profile)
+    else:
+        for c in jobs:
+            DrawJob(c, root, ntips, nstates)
+
+
+# what the worker processes need, inherited from the parent process
+_shared = None
+
+def _DrawJobNumber(k):
+    (jobs, root, ntips, nstates) = _shared
+    if not PieProfile.Active():
+        DrawJob(jobs[k], root, ntips, nstates)
+        return None
+
+    # a fresh profile, holding only this job
+    PieProfile.Start()
+    DrawJob(jobs[k], root, ntips, nstates)
+    return PieProfile.Stop()
+
+
+def Watch(argv, trees, jobs, root, ntips, nstates):
+    '''
+    Draw the pictures, then draw them again each time the treefile or the
+    optfile changes, until interrupted.  The tree is only read again when
+    the treefile changes (trees is the PieReadTree.TreeCache it was read
+    with), and a picture is only laid out again when the tree or one of
+    the options its layout depends on changes (see PieLayout.LayoutCache).
+    Bad options are reported, and then the files are watched again.
+    '''
+
+    c = jobs[0]
+    if c.treefile == "-" or [c for c in jobs if c.outfile == "-"]:
+        raise PieTreeError("watch can't be used with standard input " + \
+                "or output")
+    if c.profile != None:
+        raise PieTreeError("watch can't be used with profile")
+
+    try:
+        while True:
+            if jobs != None:
+                try:
+                    DrawJobs(jobs, root, ntips, nstates, serial=True)
+                except PieTreeError, error:
+                    _WatchError(error)
+                files = [name for name in (jobs[0].treefile, \
+                        jobs[0].optfile) if name != None]
+
+            Message("watching %s for changes" % " and ".join(files))
+            stamps = _Stamps(files)
+            while _Stamps(files) == stamps:
+                time.sleep(WATCH_SECONDS)
+
+            try:
+                (jobs, root, ntips, nstates) = PieInput.ParseInput(argv, \
+                        trees.Read)
+            except PieTreeError, error:
+                _WatchError(error)
+                jobs = None
+    except KeyboardInterrupt:
+        pass
+
+
+def _Stamps(files):
+    '''The size and modification time of each file, or None if it's gone.'''
+
+    stamps = []
+    for name in files:
+        try:
+            info = os.stat(name)
+            stamps.append((info.st_size, info.st_mtime))
+        except OSError:
+            stamps.append(None)
+    return stamps
+
+
+def _WatchError(error):
+    if error.value != None:
+        Message(error.value)
+
+
+def DryRun(jobs):
+    '''
+    Check the options of each job and say what it would draw, without
+    reading the tree or drawing anything.  The tree file is only checked
+    to be readable.
+    '''
+
+    c = jobs[0]
+    if c.treefile == None:
+        raise PieTreeError("treefile not specified")
+    if c.treefile != "-" and not os.access(c.treefile, os.R_OK):
+        raise PieTreeError('can\'t read tree file "' + c.treefile + '"')
+
+    for c in jobs:
+        # colors can be checked, but not whether every state has one
+        colors = [name for name in vars(c) if re.match("color[0-9]+$", name)]
+        for name in colors + ["linecolor", "textcolor", "backcolor"]:
+            if getattr(c, name) != None:
+                PieInput.ParseRGBColor(getattr(c, name))
+        if c.outformat == "tiles" and c.outfile == "-":
+            raise PieTreeError("tiles can only be written to a directory")
+
+        if c.job == None:
+            where = ""
+        else:
+            where = "[%s] " % c.job
+        Message("%swould draw a %s %s tree from %s to %s" % (where, \
+                c.outformat, c.shape, c.treefile, c.outfile))
+
+
+def DrawJob(c, root, ntips, nstates, outfile=None, layouts=None):
+    '''Draw one picture of the tree, as specified by the options in c.
+       It goes to c.outfile, or else to outfile if that is given (a file
+       object, such as a StringIO).
+       layouts, if given, is the PieLayout.LayoutCache to keep the layout
+       in, instead of the one shared by the whole process.'''
+
     # TODO: clean this up -- could create PieTreeXXX already
 
+    # the drawing modules are only loaded once there is something to draw,
+    # so that --help, --version, and dry runs start quickly
+    import cairo
+    import PieClasses
+    import PieText
+    import PieTiles
+
     # convert the state colors into a list
     # TODO: default to black/white/N shades of gray; allow color names rather than RGB?
     color = range(nstates)
     for i in range(nstates):
-        cc = "c.color" + str(i)
-        if eval(cc) != None:
-            color[i] = PieInput.ParseRGBColor(eval(cc))
-            exec "del(" + cc + ")"
+        name = "color" + str(i)
+        if getattr(c, name, None) != None:
+            color[i] = PieInput.ParseRGBColor(getattr(c, name))
+            delattr(c, name)
         else:
-            raise PieTreeError(cc.split(".")[1] + " not specified")
+            raise PieTreeError(name + " not specified")
     c.color = color
+    PieProfile.SetJob(c.job)
 
     c.linecolor = PieInput.ParseRGBColor(c.linecolor)
     c.textcolor = PieInput.ParseRGBColor(c.textcolor)
     if c.backcolor != None:
         c.backcolor = PieInput.ParseRGBColor(c.backcolor)
 
+    # a tile pyramid has a surface for each tile
+
+    if c.outformat == "tiles":
+        if outfile != None or c.outfile == "-":
+            raise PieTreeError("tiles can only be written to a directory")
+        with PieProfile.Phase("tiles"):
+            PieTiles.DrawTiles(c, root, ntips, nstates)
+        Message("created %s" % c.outfile)
+        return
+
     # set up the drawing surface
 
+    if outfile != None:
+        target = outfile
+    elif c.outfile == "-":
+        target = sys.stdout
+    else:
+        target = c.outfile
+
     if c.outformat == "pdf":
-        surface = cairo.PDFSurface(c.outfile, c.width, c.height)
+        surface = cairo.PDFSurface(target, c.width, c.height)
     elif c.outformat == "eps":
-        surface = cairo.PSSurface(c.outfile, c.width, c.height)
+        surface = cairo.PSSurface(target, c.width, c.height)
     elif c.outformat == "svg":
-        surface = cairo.SVGSurface(c.outfile, c.width, c.height)
+        surface = cairo.SVGSurface(target, c.width, c.height)
     elif c.outformat == "png":
         surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, \
                 int(c.width), int(c.height))
@@ -86,45 +284,75 @@ def RunPieTree():
 
     # set font face
 
-    if c.serif == "yes" and c.italic == "yes":
-        cr.select_font_face("serif", cairo.FONT_SLANT_ITALIC)
-    elif c.serif == "no" and c.italic == "yes":
-        cr.select_font_face("sans", cairo.FONT_SLANT_ITALIC)
-    elif c.serif == "yes" and c.italic == "no":
-        cr.select_font_face("serif", cairo.FONT_SLANT_NORMAL)
-    else:
-        cr.select_font_face("sans", cairo.FONT_SLANT_NORMAL)
+    text = PieText.Text(cr)
+    text.SelectStyle(c.serif, c.italic)
 
 
     ### now start working with the tree ###
 
-    if c.shape == "rect":
-        tree = PieClasses.PieTreeRect(root, ntips, nstates, cr, c)
-    elif c.shape == "radial":
-        tree = PieClasses.PieTreeRadial(root, ntips, nstates, cr, c)
-    else:    # this should never happen, but just in case...
-        raise PieTreeError("tree shape not found")
-
-    if c.tipnamesize == 0:
-        tipsize = 1e-10
-    else:
-        tipsize = tree.MaxTipNameSize()
-
-    tree.CalcXY(tipsize)
-    tree.PlotTree()
-
-    if c.scalebar:
-        tree.DrawScalebar()
+    tree = PieClasses.MakeTree(c, root, ntips, nstates, cr, text)
+    with PieProfile.Phase("tip name size"):
+        tipsize = tree.TipSize()
+    with PieProfile.Phase("layout") as phase:
+        tree.CalcXY(tipsize, layouts)
+        phase.Count("nodes", len(tree.layout.nodes))
+    with PieProfile.Phase("plot") as phase:
+        tree.PlotTree()
+        if c.scalebar:
+            tree.DrawScalebar()
+    if PieProfile.Active():
+        # counted afterwards, so as not to be timed
+        for (name, n) in tree.Drawn().iteritems():
+            phase.Count(name, n)
 
 
     ### misc final stuff ###
 
-    if c.outformat == "png":
-        surface.write_to_png(c.outfile)
-
-    # show_page()?
+    with PieProfile.Phase("finish"):
+        if c.outformat == "png":
+            surface.write_to_png(target)
+        surface.finish()
 
-    print "created %s" % c.outfile
+    if outfile == None:
+        if c.outfile == "-":
+            sys.stdout.flush()
+        else:
+            Message("created %s" % c.outfile)
+
+
+def Render(tree, options=None, messages=None, readtree=None, layouts=None):
+    '''
+    Draw a picture of a tree and return the image data as a string, for
+    programs that use PieTree as a library.  Nothing is written to a file
+    or printed, and bad input raises PieTreeError.
+    tree is the name of a tree file, or the root of a tree whose states are
+    already in place, or None to use the treefile in options.
+    options is a dictionary of options, as for PieInput.ParseOptions.
+    messages, if given, is called with the text of each warning or note;
+    otherwise they are dropped.
+    readtree is passed on to PieInput.ParseInput.
+    layouts, if given, is a PieLayout.LayoutCache to keep the layout in,
+    such as one that saves layouts on disk.
+    '''
+
+    if options == None:
+        options = {}
+    if isinstance(tree, basestring):
+        options = dict(options)
+        options["treefile"] = tree
+        tree = None
+    if messages == None:
+        messages = lambda text: None
+
+    old = SetMessageHook(messages)
+    try:
+        (c, root, ntips, nstates) = PieInput.ParseOptions(options, tree, \
+                readtree)
+        data = StringIO()
+        DrawJob(c, root, ntips, nstates, data, layouts)
+    finally:
+        SetMessageHook(old)
+    return data.getvalue()
 
 
 
@@ -134,5 +362,5 @@ if __name__ == "__main__":
         RunPieTree()
     except PieTreeError, error:
         if error.value != None:
-            print "\n" + error.value + "\n"
+            sys.stderr.write("\n" + error.value + "\n\n")
         sys.exit(1)
@@ -0,0 +1,378 @@
+#! /usr/bin/env python
+
+#--------------------------------------------------
+# Copyright 2008 Emma Goldberg
+# 
+# This file is part of PieTree.
+# 
+# PieTree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# PieTree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with PieTree.  If not, see <http://www.gnu.org/licenses/>.
+#-------------------------------------------------- 
+
+#############################
+# Module:   TreeArray.py
+#
+# A compact phylogenetic tree, stored as typed arrays rather than as one
+# TreeNode object per node.
+#############################
+
+from array import array
+from TreeStruct import TreeNode, TreeStats
+
+_NAN = float('nan')
+
+
+class TreeArray(object):
+    '''
+        TreeArray holds a whole phylogenetic tree, with one entry per node
+        in each of these:
+          parent: index of this node's ancestor (-1 for the root)
+          first_daughter: index of the leftmost daughter (-1 for a tip)
+          next_sister: index of the next daughter of the same parent
+                           (-1 for the rightmost)
+          length, time: branch length and node time (nan if unknown)
+          label, state: plain lists, since these aren't numbers
+        Node 0 is the root.  Node(i) returns a TreeNode view of node i, so
+        code written for TreeNodes also works on a TreeArray.
+    '''
+
+    def __init__(self):
+        self.parent = array('i')
+        self.first_daughter = array('i')
+        self.last_daughter = array('i')     # so daughters append in O(1)
+        self.next_sister = array('i')
+        self.length = array('d')
+        self.time = array('d')
+        self.label = []
+        self.state = []
+        self._preorder = None
+        self._postorder = None
+        self._stats = None
+
+    def __len__(self):
+        return len(self.parent)
+
+    @classmethod
+    def FromLists(cls, parents, labels, lengths):
+        '''
+        Make a TreeArray from lists of parent indices, labels and branch
+        lengths (nan for none).  Each parent must come before its daughters.
+        '''
+
+        tree = cls()
+        n = len(parents)
+        tree.parent = array('i', parents)
+        tree.label = list(labels)
+        tree.length = array('d', lengths)
+        tree.time = array('d', [_NAN]) * n
+        tree.state = [None] * n
+
+        first = tree.first_daughter = array('i', [-1]) * n
+        last = tree.last_daughter = array('i', [-1]) * n
+        sister = tree.next_sister = array('i', [-1]) * n
+        for i in xrange(1, n):
+            p = parents[i]
+            if last[p] < 0:
+                first[p] = i
+            else:
+                sister[last[p]] = i
+            last[p] = i
+
+        return tree
+
+    @classmethod
+    def FromNodes(cls, root):
+        '''Make a TreeArray from the tree of TreeNodes below root.'''
+
+        tree = cls()
+        stack = [(root, -1)]
+        while stack:
+            (node, p) = stack.pop()
+            i = tree.AddNode(p, node.label, node.length)
+            if node.time != None:
+                tree.time[i] = node.time
+            tree.state[i] = node.state
+            if node.daughters != None:
+                for d in reversed(node.daughters):
+                    stack.append((d, i))
+        return tree
+
+    def ToNodes(self):
+        '''Make a tree of TreeNodes from this one, and return its root.'''
+
+        nodes = [None] * len(self.parent)
+        for i in self.Preorder():
+            length = self.length[i]
+            if length != length:
+                length = None
+            p = self.parent[i]
+            if p < 0:
+                node = TreeNode(self.label[i], None, length, self.state[i])
+            else:
+                parent = nodes[p]
+                node = TreeNode(self.label[i], None, length, self.state[i], \
+                        parent)
+                if parent.daughters == None:
+                    parent.daughters = [node]
+                else:
+                    parent.daughters.append(node)
+            time = self.time[i]
+            if time == time:
+                node.time = time
+            nodes[i] = node
+        return nodes[0]
+
+    def AddNode(self, parent=-1, label=None, length=None):
+        '''Add a node as the rightmost daughter of parent; return its index.'''
+
+        i = len(self.parent)
+        self.parent.append(parent)
+        self.first_daughter.append(-1)
+        self.last_daughter.append(-1)
+        self.next_sister.append(-1)
+        if length == None:
+            self.length.append(_NAN)
+        else:
+            self.length.append(length)
+        self.time.append(_NAN)
+        self.label.append(label)
+        self.state.append(None)
+        self._preorder = None
+        self._postorder = None
+        self._stats = None
+
+        if parent >= 0:
+            if self.last_daughter[parent] < 0:
+                self.first_daughter[parent] = i
+            else:
+                self.next_sister[self.last_daughter[parent]] = i
+            self.last_daughter[parent] = i
+
+        return i
+
+    def Daughters(self, i):
+        '''Return the indices of node i's daughters, left to right.'''
+
+        daughters = []
+        d = self.first_daughter[i]
+        while d >= 0:
+            daughters.append(d)
+            d = self.next_sister[d]
+        return daughters
+
+    def Preorder(self, i=0):
+        '''
+        Return the indices of node i and all its descendants, each node before
+        its daughters, and left to right.  For the root, this is cached.
+        '''
+
+        if i == 0 and self._preorder != None:
+            return self._preorder
+
+        first = self.first_daughter
+        sister = self.next_sister
+        order = array('i')
+        stack = [i]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            d = first[node]
+            if d >= 0:
+                daughters = []
+                while d >= 0:
+                    daughters.append(d)
+                    d = sister[d]
+                daughters.reverse()
+                stack.extend(daughters)
+
+        if i == 0:
+            self._preorder = order
+        return order
+
+    def Postorder(self, i=0):
+        '''
+        Return the indices of node i and all its descendants, each node after
+        its daughters, and left to right.  For the root, this is cached.
+        '''
+
+        if i == 0 and self._postorder != None:
+            return self._postorder
+
+        first = self.first_daughter
+        sister = self.next_sister
+        order = array('i')
+        stack = [i]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            d = first[node]
+            while d >= 0:
+                stack.append(d)
+                d = sister[d]
+        order.reverse()
+
+        if i == 0:
+            self._postorder = order
+        return order
+
+    def Node(self, i):
+        '''Return a TreeNode view of node i.'''
+        return TreeNodeView(self, i)
+
+    def Root(self):
+        '''Return a TreeNode view of the root.'''
+        return TreeNodeView(self, 0)
+
+
+def _NumberProperty(name, doc):
+    '''A view attribute stored in a float array, with nan standing for None.'''
+
+    def get(self):
+        value = getattr(self.tree, name)[self.index]
+        if value != value:
+            return None
+        return value
+    def set(self, value):
+        if value == None:
+            value = _NAN
+        getattr(self.tree, name)[self.index] = value
+    return property(get, set, doc=doc)
+
+
+class TreeNodeView(TreeNode):
+    '''
+        A TreeNode that is only a window onto one node of a TreeArray.
+        Views are made on the fly, so they cost nothing to keep around, and
+        two views of the same node compare equal.  Values can be changed
+        through a view, but the shape of the tree can't.
+    '''
+
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    def Preorder(self):
+        ''' as for TreeNode, but the order is kept by the TreeArray '''
+        return NodeViews(self.tree, self.tree.Preorder(self.index))
+
+    def Postorder(self):
+        ''' as for TreeNode, but the order is kept by the TreeArray '''
+        return NodeViews(self.tree, self.tree.Postorder(self.index))
+
+    def ForgetOrder(self):
+        ''' as for TreeNode '''
+        self.tree._preorder = None
+        self.tree._postorder = None
+        self.tree._stats = None
+
+    def Stats(self):
+        ''' as for TreeNode, but found from the arrays, and cached by the
+            TreeArray for the root '''
+        tree = self.tree
+        if self.index == 0 and tree._stats != None:
+            return tree._stats
+
+        order = tree.Preorder(self.index)
+        where = array('i', [0]) * len(tree)
+        parent = [-1] * len(order)
+        length = [0.0] * len(order)
+        tree_parent = tree.parent
+        tree_length = tree.length
+        for (k, i) in enumerate(order):
+            where[i] = k
+            if k > 0:
+                parent[k] = where[tree_parent[i]]
+            if tree_length[i] == tree_length[i]:
+                length[k] = tree_length[i]
+        stats = TreeStats(NodeViews(tree, order), parent, length)
+
+        if self.index == 0:
+            tree._stats = stats
+        return stats
+
+    def __eq__(self, other):
+        return isinstance(other, TreeNodeView) and \
+                other.tree is self.tree and other.index == self.index
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((id(self.tree), self.index))
+
+    def _GetLabel(self):
+        return self.tree.label[self.index]
+    def _SetLabel(self, value):
+        self.tree.label[self.index] = value
+    label = property(_GetLabel, _SetLabel)
+
+    def _GetState(self):
+        return self.tree.state[self.index]
+    def _SetState(self, value):
+        self.tree.state[self.index] = value
+    state = property(_GetState, _SetState)
+
+    @property
+    def parent(self):
+        p = self.tree.parent[self.index]
+        if p < 0:
+            return None
+        return TreeNodeView(self.tree, p)
+
+    @property
+    def daughters(self):
+        tree = self.tree
+        d = tree.first_daughter[self.index]
+        if d < 0:
+            return None
+        daughters = []
+        while d >= 0:
+            daughters.append(TreeNodeView(tree, d))
+            d = tree.next_sister[d]
+        return daughters
+
+    length = _NumberProperty('length', "branch length")
+    time = _NumberProperty('time', "node time")
+
+
+class NodeViews(object):
+    '''
+        A sequence of TreeNodeViews for a list of node indices.  The views are
+        made one at a time as they are needed, not all at once.
+    '''
+
+    __slots__ = ('tree', 'indices')
+
+    def __init__(self, tree, indices):
+        self.tree = tree
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return NodeViews(self.tree, self.indices[k])
+        return TreeNodeView(self.tree, self.indices[k])
+
+    def __iter__(self):
+        tree = self.tree
+        for i in self.indices:
+            yield TreeNodeView(tree, i)
+
+    def __reversed__(self):
+        tree = self.tree
+        for i in reversed(self.indices):
+            yield TreeNodeView(tree, i)
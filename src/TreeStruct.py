@@ -28,7 +28,7 @@
 # Pulled from my BiSSE library.
 #############################
 
-class TreeNode:
+class TreeNode(object):
     '''
         TreeNode contains the properties of a single node (or tip) in a 
         phylogenetic tree
@@ -42,6 +42,11 @@ class TreeNode:
            length: the time from this node to its ancestor
                       (computed automatically if times are specified)
     '''
+
+    # no per-node __dict__; this matters for trees with very many nodes
+    __slots__ = ('label', 'time', 'state', 'parent', 'daughters', 'length', \
+            '_preorder', '_postorder', '_stats')
+
     def __init__(self, label=None, time=None, length=None, state=None, parent=None, \
             daughters=None):
         self.label = label
@@ -54,6 +59,9 @@ class TreeNode:
             self.length = self.time - self.parent.time
         else:
             self.length = length
+        self._preorder = None
+        self._postorder = None
+        self._stats = None
 
 
     def PrintNode(self):
@@ -88,66 +96,149 @@ class TreeNode:
                 d.PrintTree(indent+2)
 
 
-    def NewickString(self):
-        ''' returns all descendants from this node as a Newick string '''
+    def NewickString(self, precision=None, nodelabels=True):
+        ''' returns all descendants from this node as a Newick string; see
+            Newick.Write, which can also write straight to a file '''
+        import Newick
         from cStringIO import StringIO
-        nstr = StringIO()    # allows for more efficient string concatenation
-        nstr.write("(")
-        self._NewickStringGuts(nstr)
-        nstr.write(");")
-        returnme = nstr.getvalue()
-        nstr.close()
-        return returnme
-    def _NewickStringGuts(self, nstr):
-        if self.daughters == None:
-            nstr.write( str(self.label) )
-            if self.length != None:
-                nstr.write( ":%f" % (self.length) )
-        else:
-            nstr.write("(")
-            for d in self.daughters:
-                d._NewickStringGuts(nstr)
-                nstr.write(",")
-            nstr.seek(-1, 1)    # remove that last comma
-            nstr.write(")")
-            #nstr.write( "%s_%s" % (str(self.state), str(self.label)) )
-            nstr.write( str(self.label) )
-            if self.length != None:
-                nstr.write( ":%f" % (self.length) )
+        nstr = StringIO()
+        Newick.Write(self, nstr, precision, nodelabels)
+        return nstr.getvalue().rstrip("\n")
+
+
+    def Preorder(self):
+        '''
+        returns a list of this node and all its descendants, each node before
+        its daughters, and left to right; the list is computed once and cached
+        (so call ForgetOrder() if the shape of the tree below here changes)
+        '''
+        if self._preorder == None:
+            order = []
+            stack = [self]
+            while stack:
+                node = stack.pop()
+                order.append(node)
+                if node.daughters != None:
+                    stack.extend(reversed(node.daughters))
+            self._preorder = order
+        return self._preorder
+
+    def Postorder(self):
+        '''
+        returns a list of this node and all its descendants, each node after
+        its daughters, and left to right; cached like Preorder()
+        '''
+        if self._postorder == None:
+            order = []
+            stack = [self]
+            while stack:
+                node = stack.pop()
+                order.append(node)
+                if node.daughters != None:
+                    stack.extend(node.daughters)
+            order.reverse()
+            self._postorder = order
+        return self._postorder
+
+    def ForgetOrder(self):
+        ''' discards the cached Preorder() and Postorder() lists, and the
+            cached Stats() '''
+        self._preorder = None
+        self._postorder = None
+        self._stats = None
+
+    def Stats(self):
+        '''
+        returns the TreeStats of this node and all its descendants; they are
+        computed once and cached like Preorder() (so call ForgetOrder() if
+        the shape or the branch lengths of the tree below here change)
+        '''
+        if self._stats == None:
+            # a preorder walk that keeps track of each node's parent
+            nodes = []
+            parent = []
+            length = []
+            stack = [(self, -1)]
+            while stack:
+                (node, p) = stack.pop()
+                i = len(nodes)
+                nodes.append(node)
+                parent.append(p)
+                if node.length != None:
+                    length.append(node.length)
+                else:
+                    length.append(0.0)
+                if node.daughters != None:
+                    for d in reversed(node.daughters):
+                        stack.append((d, i))
+            if self._preorder == None:
+                self._preorder = nodes
+            self._stats = TreeStats(nodes, parent, length)
+        return self._stats
 
 
     def TipStates(self):
         ''' returns a list of tip labels and trait values in left-to-right order '''
-        tiplist = []
-        self._TipStatesGuts(tiplist)
-        return tiplist
-
-    def _TipStatesGuts(self, tiplist):
-        if self.daughters == None:
-            tiplist.append([self.label, self.state])
-        else:
-            for d in self.daughters:
-                d._TipStatesGuts(tiplist)
+        return [[node.label, node.state] for node in self.Preorder() \
+                if node.daughters == None]
 
     def Age(self):
         '''
-        returns the greater of the difference in node times of this node and
-        its left-most or right-most descendent (cheap trick to avoid checking
-        all root-to-tip distances)
+        returns the greatest distance (sum of branch lengths) from this node
+        to any of its tips
         '''
+        return self.Stats().height[0]
 
-        node = self
-        while node.daughters != None:
-            node = node.daughters[0]
-        timeL = node.time
 
-        node = self
-        while node.daughters != None:
-            node = node.daughters[-1]
-        timeR = node.time
-
-        a = [timeL - self.time, timeR - self.time]
-        b = map(abs, a)
-        i = b.index(max(b))
+class TreeStats(object):
+    '''
+        TreeStats holds what is known about every subtree of a tree, found
+        in one walk down the tree and one sweep back up (a postorder pass).
+        Everything is kept in lists indexed by each node's place in the
+        preorder traversal, so the root is 0 and each node comes before
+        its daughters:
+          nodes: the nodes themselves
+          parent: index of each node's parent (-1 for the root)
+          length: each node's branch length (0 if it has none)
+          size: number of nodes in the subtree starting at each node
+          tips: number of tips in that subtree
+          depth: distance from the root to each node, not counting the
+                 root's own branch
+          height: distance from each node to the farthest tip below it
+          multi: indices of the internal nodes without exactly two
+                 daughters
+    '''
 
-        return a[i]
+    def __init__(self, nodes, parent, length):
+        n = len(parent)
+        self.nodes = nodes
+        self.parent = parent
+        self.length = length
+
+        depth = [0.0] * n
+        for i in xrange(1, n):
+            depth[i] = depth[parent[i]] + length[i]
+
+        size = [1] * n
+        tips = [0] * n
+        height = [0.0] * n
+        ndaughters = [0] * n
+        for i in xrange(n-1, 0, -1):
+            p = parent[i]
+            if size[i] == 1:
+                tips[i] = 1
+            size[p] += size[i]
+            tips[p] += tips[i]
+            ndaughters[p] += 1
+            h = height[i] + length[i]
+            if h > height[p]:
+                height[p] = h
+        if n == 1:
+            tips[0] = 1
+
+        self.size = size
+        self.tips = tips
+        self.depth = depth
+        self.height = height
+        self.multi = [i for (i, k) in enumerate(ndaughters) \
+                if k != 0 and k != 2]
@@ -0,0 +1,137 @@
+#! /usr/bin/env python
+
+#--------------------------------------------------
+# Copyright 2008 Emma Goldberg
+#
+# This file is part of PieTree.
+#
+# PieTree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PieTree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PieTree.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------
+
+######################################################
+# Module:  test_newick_read.py
+######################################################
+
+'''Tests of the Newick tokenizer and parser (Newick.Read, ReadCompact).'''
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import Newick
+
+
+def Nodes(root):
+    '''The (label, length, parent label) of each node, in preorder.'''
+
+    nodes = []
+    for node in root.Preorder():
+        if node.parent == None:
+            parent = None
+        else:
+            parent = node.parent.label
+        nodes.append((node.label, node.length, parent))
+    return nodes
+
+
+class ReadTest(unittest.TestCase):
+
+    def Both(self, text):
+        '''Read text both ways, check they agree, and return the nodes.'''
+
+        nodes = Nodes(Newick.Read(text))
+        self.assertEqual(Nodes(Newick.ReadCompact(text).Root()), nodes)
+        return nodes
+
+    def testLabelsAndLengths(self):
+        self.assertEqual(self.Both("((a:1,b:2.5)n:3,c:4)r;"), [
+                ("r", 0.0, None), ("n", 3.0, "r"), ("a", 1.0, "n"),
+                ("b", 2.5, "n"), ("c", 4.0, "r")])
+
+    def testUnlabeledAndNoLengths(self):
+        self.assertEqual(self.Both("((,b),c);"), [
+                (None, 0.0, None), (None, None, None), (None, None, None),
+                ("b", None, None), ("c", None, None)])
+
+    def testWhitespace(self):
+        self.assertEqual(self.Both(" ( a b : 1 ,\tc:2 ) r ;\n"), [
+                ("r", 0.0, None), ("a b", 1.0, "r"), ("c", 2.0, "r")])
+
+    def testQuotedLabels(self):
+        self.assertEqual(self.Both("('a,b':1,'it''s (x)':2)'root;';"), [
+                ("root;", 0.0, None), ("a,b", 1.0, "root;"),
+                ("it's (x)", 2.0, "root;")])
+
+    def testQuoteAfterWhitespace(self):
+        self.assertEqual(self.Both("( 'a,b':1,  'c:d' :2);"), [
+                (None, 0.0, None), ("a,b", 1.0, None), ("c:d", 2.0, None)])
+
+    def testSurroundingParentheses(self):
+        self.assertEqual(self.Both("((a:1,b:2)r:0.5);"), [
+                ("r", 0.5, None), ("a", 1.0, "r"), ("b", 2.0, "r")])
+
+    def testTranslate(self):
+        root = Newick.Read("(1:1,2:2);", {"1": "alpha"})
+        self.assertEqual([node.label for node in root.Preorder()],
+                [None, "alpha", "2"])
+
+    def testDeepTree(self):
+        # a caterpillar far deeper than Python's recursion limit
+        depth = 20000
+        text = "(" * depth + "a" + "".join([",t%d)" % k \
+                for k in xrange(depth)]) + ";"
+        for root in (Newick.Read(text), Newick.ReadCompact(text).Root()):
+            self.assertEqual(len(root.Preorder()), 2 * depth + 1)
+
+
+class ErrorTest(unittest.TestCase):
+
+    def assertError(self, text, reason):
+        for read in (Newick.Read, Newick.ReadCompact):
+            try:
+                read(text)
+            except Newick.NewickError, error:
+                self.assertEqual(error.reason, reason)
+            else:
+                self.fail("no error for " + repr(text))
+
+    def testMissingSemicolon(self):
+        self.assertError("(a,b)", "Newick strings must end with a ;")
+
+    def testMismatched(self):
+        self.assertError("((a,b);", "mismatched ( ) in Newick string")
+        self.assertError("(a,b));", "mismatched ( ) in Newick string")
+
+    def testEmptyParentheses(self):
+        self.assertError("(a,());", "shouldn't have () in Newick string")
+
+    def testBadLength(self):
+        self.assertError("(a:x,b);", 'bad branch length "x" in Newick string')
+
+    def testTooManySemicolons(self):
+        self.assertError("(a,b);(c,d);", "too many ; in Newick string")
+
+    def testMisplaced(self):
+        self.assertError("(a,b)c(d);", "misplaced ( in Newick string")
+        self.assertError("(a:,b);", "misplaced , in Newick string")
+        self.assertError("(a,b):1:2;", "misplaced : in Newick string")
+
+    def testNoParenthesis(self):
+        self.assertError("a;", "Newick strings must start with a (")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+#! /usr/bin/env python
+
+#--------------------------------------------------
+# Copyright 2008 Emma Goldberg
+#
+# This file is part of PieTree.
+#
+# PieTree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PieTree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PieTree.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------
+
+
+######################################################
+# Module:  test_newick_write.py
+######################################################
+
+'''Tests of writing trees as Newick strings (Newick.Write).'''
+
+import os
+import sys
+import random
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import Newick
+import PieReadTree
+
+
+TREE = "((a:1,'b c':0.123456789)n:3,(it's:4,d)m:2)r;"
+
+
+def Write(root, **options):
+    '''Return what Newick.Write writes for the tree.'''
+
+    out = StringIO()
+    Newick.Write(root, out, **options)
+    return out.getvalue()
+
+
+def Nodes(root):
+    '''The (label, length, number of daughters) of each node, in preorder.'''
+
+    return [(node.label, node.length, len(node.daughters or ())) \
+            for node in root.Preorder()]
+
+
+class WriteTest(unittest.TestCase):
+
+    def Roots(self, text):
+        '''The tree read both ways.'''
+
+        return (Newick.Read(text), Newick.ReadCompact(text).Root())
+
+    def testWrite(self):
+        for root in self.Roots(TREE):
+            self.assertEqual(Write(root), "((a:1.0,'b c':0.123456789)n:3.0," \
+                    "('it''s':4.0,d)m:2.0)r:0.0;\n")
+
+    def testPrecision(self):
+        for root in self.Roots(TREE):
+            self.assertEqual(Write(root, precision=3),
+                    "((a:1,'b c':0.123)n:3,('it''s':4,d)m:2)r:0;\n")
+
+    def testNoNodeLabels(self):
+        for root in self.Roots(TREE):
+            self.assertEqual(Write(root, nodelabels=False),
+                    "((a:1.0,'b c':0.123456789):3.0,('it''s':4.0,d):2.0)" \
+                    ":0.0;\n")
+
+    def testRoundTrip(self):
+        # a random tree, with lengths that need every digit
+        rng = random.Random(1)
+        text = "t0:%r" % rng.random()
+        for k in xrange(1, 200):
+            text = "(%s,t%d:%r)n%d:%r" % (text, k, rng.random(), k,
+                    rng.random())
+        text = "(" + text + ");"
+        for root in self.Roots(text):
+            again = Newick.Read(Write(root))
+            self.assertEqual(Nodes(again), Nodes(Newick.Read(text)))
+
+    def testDeepTree(self):
+        depth = 20000
+        text = "(" * depth + "a" + "".join([",t%d:1)" % k \
+                for k in xrange(depth)]) + ";"
+        for root in self.Roots(text):
+            self.assertEqual(len(Newick.Read(Write(root)).Preorder()),
+                    2 * depth + 1)
+
+    def testNewickString(self):
+        self.assertEqual(Newick.Read("(a:1,b:2)r;").NewickString(),
+                "(a:1.0,b:2.0)r:0.0;")
+
+    def testStates(self):
+        (fd, name) = tempfile.mkstemp(suffix=".ttn")
+        os.close(fd)
+        try:
+            for compact in (False, True):
+                root = self.Roots("((a:1,b:1)n:1,c:2)r;")[compact]
+                states = {"a": 0, "b": 1, "c": 0, "n": [0.25, 0.75],
+                        "r": [0.5, 0.5]}
+                for node in root.Preorder():
+                    node.state = states[node.label]
+                outfile = open(name, "w")
+                Newick.Write(root, outfile, states=True)
+                outfile.close()
+
+                (again, nstates) = PieReadTree.ReadFromFileTTN(name)
+                self.assertEqual(nstates, 2)
+                self.assertEqual([(node.label, node.state) \
+                        for node in again.Preorder()],
+                        [(node.label, node.state) \
+                        for node in root.Preorder()])
+        finally:
+            os.remove(name)
+
+
+if __name__ == "__main__":
+    unittest.main()
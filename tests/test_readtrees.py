@@ -0,0 +1,125 @@
+#! /usr/bin/env python
+
+#--------------------------------------------------
+# Copyright 2008 Emma Goldberg
+#
+# This file is part of PieTree.
+#
+# PieTree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PieTree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PieTree.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------
+
+######################################################
+# Module:  test_readtrees.py
+######################################################
+
+'''
+Tests of reading a series of trees from a Newick or NEXUS file
+(Newick.ReadTrees).
+'''
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import Newick
+
+
+NEXUS = '''#NEXUS
+[a comment; with a ;]
+BEGIN TAXA; DIMENSIONS NTAX=3; END;
+Begin trees;
+  Translate 1 alpha, 2 'b c';
+  tree one = [&U] (1:1,2:2);
+  tree two = ((1,2)x:1,3:1);
+End;
+'''
+
+NEWICK = '''# a comment line
+(a,b);
+(c,
+ d)[spread over lines; with a comment];
+(e,f);
+'''
+
+
+class ReadTreesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.names = []
+
+    def tearDown(self):
+        for name in self.names:
+            os.remove(name)
+
+    def File(self, text):
+        '''Write text to a temporary file, and return its name.'''
+
+        (fd, name) = tempfile.mkstemp(suffix=".tre")
+        outfile = os.fdopen(fd, "w")
+        outfile.write(text)
+        outfile.close()
+        self.names.append(name)
+        return name
+
+    def Labels(self, text, **options):
+        '''The labels of each tree in the file, in preorder.'''
+
+        return [[node.label for node in root.Preorder()] \
+                for root in Newick.ReadTrees(self.File(text), **options)]
+
+    def testNewick(self):
+        self.assertEqual(self.Labels(NEWICK), [[None, "a", "b"],
+                [None, "c", "d"], [None, "e", "f"]])
+
+    def testBurninAndThin(self):
+        self.assertEqual(self.Labels(NEWICK, burnin=1), [[None, "c", "d"],
+                [None, "e", "f"]])
+        self.assertEqual(self.Labels(NEWICK, thin=2), [[None, "a", "b"],
+                [None, "e", "f"]])
+        self.assertEqual(self.Labels(NEWICK, burnin=3), [])
+        self.assertRaises(ValueError, self.Labels, NEWICK, thin=0)
+
+    def testNexus(self):
+        self.assertEqual(self.Labels(NEXUS), [[None, "alpha", "b c"],
+                [None, "x", "alpha", "b c", "3"]])
+
+    def testCompact(self):
+        trees = list(Newick.ReadTrees(self.File(NEXUS), compact=True))
+        self.assertEqual([tree.label for tree in trees],
+                [[None, "alpha", "b c"], [None, "x", "alpha", "b c", "3"]])
+
+    def assertError(self, text, reason):
+        try:
+            self.Labels(text)
+        except Newick.NewickError, error:
+            self.assertEqual(error.reason, reason)
+        else:
+            self.fail("no error for " + repr(text))
+
+    def testErrors(self):
+        self.assertError("(a,b);\n(c,d)",
+                "file ends without a ; after the last statement")
+        self.assertError("#NEXUS\nbegin trees; translate 1; tree a = " + \
+                "(1,2); end;", "bad TRANSLATE table in NEXUS file")
+        self.assertError("#NEXUS\nbegin trees; tree (1,2); end;",
+                "bad TREE command in NEXUS file")
+        self.assertError("(a,b);\n(c,d));\n",
+                "mismatched ( ) in Newick string")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+#! /usr/bin/env python
+
+#--------------------------------------------------
+# Copyright 2008 Emma Goldberg
+#
+# This file is part of PieTree.
+#
+# PieTree is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PieTree is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PieTree.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------
+
+######################################################
+# Module:  test_states.py
+######################################################
+
+'''
+Tests of reading the states of a .ttn file, and of reporting every problem
+with them at once (PieReadTree).
+'''
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import PieReadTree
+from PieError import PieTreeError, SetMessageHook
+
+
+TREE = "((a:1,b:1)n:1,(c:1,d:1)m:1)r;\n"
+
+
+class StatesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.names = []
+        self.messages = []
+        self.old = SetMessageHook(self.messages.append)
+
+    def tearDown(self):
+        SetMessageHook(self.old)
+        for name in self.names:
+            os.remove(name)
+
+    def Read(self, text, compact=False):
+        '''Read a .ttn file holding text, and return (root, nstates).'''
+
+        (fd, name) = tempfile.mkstemp(suffix=".ttn")
+        outfile = os.fdopen(fd, "w")
+        outfile.write(text)
+        outfile.close()
+        self.names.append(name)
+        return PieReadTree.ReadFromFileTTN(name, compact)
+
+    def Error(self, text):
+        '''Return the lines of the error raised on reading text.'''
+
+        for compact in (False, True):
+            try:
+                self.Read(text, compact)
+            except PieTreeError, error:
+                lines = error.value.split("\n")
+            else:
+                self.fail("no error for " + repr(text))
+        return lines
+
+    def testStates(self):
+        for compact in (False, True):
+            (root, nstates) = self.Read(TREE + "a 0\nb 2\nc 1\nd 0\n" + \
+                    "n 0.5 0.25 0.25\nm 0 1 0\nr 0.2 0.3 0.5\n", compact)
+            self.assertEqual(nstates, 3)
+            self.assertEqual([(node.label, node.state) \
+                    for node in root.Preorder()], [
+                    ("r", [0.2, 0.3, 0.5]), ("n", [0.5, 0.25, 0.25]),
+                    ("a", 0), ("b", 2), ("m", [0, 1, 0]), ("c", 1),
+                    ("d", 0)])
+        self.assertEqual(self.messages, [])
+
+    def testEveryProblem(self):
+        lines = self.Error(TREE + "a 0\nb 3\nc 1 0\nd x y\nn 0.5 0.2\n" + \
+                "m 0.5\nr 0.3 0.3 0.3\n")
+        self.assertEqual(lines[1:6], [
+                "   1 lines can't be read: d x y",
+                "   2 nodes don't have 3 state values: n (2 values), " + \
+                        "m (1 values)",
+                "   1 tips have more than one state value: c (2 values)",
+                "   1 tip states are not between 0 and 2: b (3)",
+                "   1 nodes' state values don't sum to 1: r (0.9)"])
+
+    def testNoReadableStates(self):
+        lines = self.Error(TREE + "a x y\nb foo\n")
+        self.assertEqual(lines[:2], [
+                "PieTree ERROR: Problems with the character states:",
+                "   2 lines can't be read: a x y, b foo"])
+
+    def testNoStates(self):
+        lines = self.Error(TREE)
+        self.assertTrue(lines[0].startswith(
+                "PieTree ERROR: No character states found in file"))
+
+    def testUnlabeledNodes(self):
+        # internal nodes without labels aren't missing from the states
+        self.Read("((a:1,b:1):1,c:2)r;\na 0\nb 1\nc 0\nr 0.5 0.5\n")
+        self.assertEqual(self.messages, [])
+
+    def testMissingStates(self):
+        self.Read(TREE + "a 0\nc 1\nr 0.5 0.5\n")
+        self.assertEqual(self.messages, ["NOTE: no state given for " + \
+                "2 tips and 2 nodes: n, b, m, d"])
+
+
+if __name__ == "__main__":
+    unittest.main()